@@ -1,24 +1,125 @@
+from argparse import ArgumentParser
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 import pandas
 import os
+import re
 
-os.makedirs("anon_output_merged", exist_ok=True)
-
-files = glob("output_merged/*.csv")
-files = sorted(files, key=os.path.getsize)
-pandas.options.display.max_colwidth = 200
-total = 0
-for file in files:
-    print(file)
-    df = pandas.read_csv(file, index_col=0)
-    print("Number of NaN values in title column:", sum(df.title.isna()))
-    df.dropna(subset=["title"], inplace=True)
-    print("rows before anonymization: ", len(df))
-    df = df[~df.title.str.contains(r"[a-zA-Z]@[a-zA-Z]{2,}\.[a-zA-Z]{2,6}")]
-    df = df[~df.title.str.contains(r"(^|^[^0-9]|[^0-9][^0-9])(00)?(420|421)?\s*(\d\s*){9}([^0-9][^0-9]|[^0-9]$|$)")]
-    print("rows after anonymization: ", len(df))
-    total = total + len(df)
-    df.to_csv("anon_"+file, index=False)
-    print("=====")
-
-print("Total: ", total)
\ No newline at end of file
+from bazos_compress import BlockWriter
+from bazos_manifest import PartitionStats, build_manifest, write_sidecar
+
+# the patterns are combined into one regex, they must not use named groups themselves
+detectors = {
+    "email": r"[a-zA-Z]@[a-zA-Z]{2,}\.[a-zA-Z]{2,6}",
+    "phone": r"(^|^[^0-9]|[^0-9][^0-9])(00)?(420|421)?\s*(\d\s*){9}([^0-9][^0-9]|[^0-9]$|$)",
+    "iban": r"\b(CZ|SK)\d{2}(\s?\d{4}){5}\b",
+    "url": r"(https?://|www\.)\S+",
+}
+default_detectors = ["email", "phone"]
+
+
+def compile_detectors(names):
+    # one pass over the titles, the named group tells which detector matched first
+    return re.compile("|".join(f"(?P<{name}>{detectors[name]})" for name in names))
+
+
+def scan_titles(pattern, titles):
+    matches = [pattern.search(title) for title in titles]
+    keep = [m is None for m in matches]
+    rejected = Counter(m.lastgroup for m in matches if m is not None)
+    return keep, rejected
+
+
+def anonymize_file(
+    file,
+    output_path,
+    names=default_detectors,
+    chunksize=1000000,
+    compress=False,
+    threads=None,
+):
+    pattern = compile_detectors(names)
+    stats = PartitionStats()
+    executor = None
+    writer = None
+    if compress:
+        # the blocks are compressed in the background while the next chunks are scanned
+        executor = ThreadPoolExecutor(threads)
+    rejected = Counter()
+    missing = 0
+    before = 0
+    total = 0
+    # dtype=str writes the other columns back exactly as they were read
+    chunks = pandas.read_csv(file, index_col=0, dtype=str, chunksize=chunksize)
+    with open(output_path, "w", newline="") as f:
+        for i, df in enumerate(chunks):
+            missing += sum(df.title.isna())
+            df = df.dropna(subset=["title"])
+            before += len(df)
+            keep, chunk_rejected = scan_titles(pattern, df.title)
+            rejected.update(chunk_rejected)
+            df = df[keep]
+            text = df.to_csv(index=False, header=i == 0)
+            f.write(text)
+            datetime = pandas.to_datetime(df["datetime"], utc=True)
+            stats.update(df, datetime)
+            if executor is not None:
+                if writer is None:
+                    header = df.head(0).to_csv(index=False)
+                    writer = BlockWriter(output_path + ".gz", header, executor, chunksize)
+                writer.write(text, datetime)
+            total += len(df)
+    gz_path = None
+    if writer is not None:
+        writer.close()
+        gz_path = writer.path
+    if executor is not None:
+        executor.shutdown()
+    print("Number of NaN values in title column:", missing)
+    print("rows before anonymization: ", before)
+    for name in names:
+        print(f"rows with {name}: ", rejected[name])
+    print("rows after anonymization: ", total)
+    write_sidecar(output_path, stats, gz_path)
+    return total
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser(description="Drop the ads with personal data in the title")
+    ap.add_argument(
+        "--detectors",
+        type=str,
+        nargs="+",
+        default=default_detectors,
+        choices=list(detectors),
+        help="Kinds of personal data to look for",
+    )
+    ap.add_argument(
+        "--chunksize",
+        type=int,
+        default=1000000,
+        help="Number of rows read at once",
+    )
+    ap.add_argument(
+        "--compress",
+        action="store_true",
+        help="Also write block gzip files with an index, see bazos_compress.py",
+    )
+    args = ap.parse_args()
+
+    os.makedirs("anon_output_merged", exist_ok=True)
+
+    files = glob("output_merged/*.csv")
+    files = sorted(files, key=os.path.getsize)
+    pandas.options.display.max_colwidth = 200
+    total = 0
+    for file in files:
+        print(file)
+        total = total + anonymize_file(
+            file, "anon_"+file, args.detectors, args.chunksize, args.compress
+        )
+        print("=====")
+
+    build_manifest("anon_output_merged")
+    print("Total: ", total)
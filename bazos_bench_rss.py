@@ -0,0 +1,84 @@
+from argparse import ArgumentParser
+from glob import glob
+import time
+
+import feedparser
+
+import bazos_rss
+
+compared_fields = ["title", "link", "published", "published_parsed"]
+
+
+def bench(parse, bodies, repeat):
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    for _ in range(repeat):
+        for body in bodies:
+            parse(body)
+    wall = time.perf_counter() - start_wall
+    cpu = time.process_time() - start_cpu
+    return wall, cpu
+
+
+def compare(path, body):
+    # the fast path must agree with feedparser on everything the scraper keeps
+    expected = feedparser.parse(body)["entries"]
+    try:
+        got = bazos_rss.parse_feed(body)
+    except bazos_rss.FeedFormatError as e:
+        print(f"{path}: fast path rejected the feed ({e}), feedparser fallback is used")
+        return False
+
+    if len(got) != len(expected):
+        print(f"{path}: {len(got)} entries, feedparser found {len(expected)}")
+        return False
+    for a, b in zip(got, expected):
+        for field in compared_fields:
+            if a[field] != b.get(field):
+                print(f"{path}: {field} differs: {a[field]!r} != {b.get(field)!r}")
+                return False
+    return True
+
+
+def main(paths, repeat):
+    bodies = []
+    for path in paths:
+        with open(path, "rb") as f:
+            body = f.read()
+        bodies.append(body)
+        compare(path, body)
+
+    if not bodies:
+        print("No feeds to benchmark")
+        return
+
+    num_parses = len(bodies) * repeat
+    results = {
+        "feedparser": bench(feedparser.parse, bodies, repeat),
+        "bazos_rss": bench(bazos_rss.parse_feed, bodies, repeat),
+    }
+    for name, (wall, cpu) in results.items():
+        print(
+            f"{name}: {wall:.2f} s wall, {cpu:.2f} s CPU, {1000 * cpu / num_parses:.3f} ms CPU per feed"
+        )
+    speedup = results["feedparser"][1] / results["bazos_rss"][1]
+    print(f"The fast path uses {speedup:.1f}x less CPU per poll")
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser(
+        description="Compare the feedparser and bazos_rss parsers on recorded feeds"
+    )
+    ap.add_argument(
+        "feeds",
+        type=str,
+        nargs="+",
+        help="Recorded rss.php responses, glob patterns are expanded",
+    )
+    ap.add_argument(
+        "--repeat", type=int, default=20, help="Number of times every feed is parsed"
+    )
+    args = ap.parse_args()
+
+    paths = sorted(path for pattern in args.feeds for path in glob(pattern))
+    main(paths, args.repeat)
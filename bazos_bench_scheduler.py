@@ -0,0 +1,359 @@
+from argparse import ArgumentParser
+from collections import Counter
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+import asyncio
+import bisect
+import json
+import logging
+import math
+import multiprocessing
+import random
+import threading
+import time
+
+from bazos_engine import HostCircuitBreaker, HostRateLimiter, ScrapeEngine
+from bazos_fetch import FeedFetcher
+from bazos_interval import estimators, feed_size, make_estimator
+from bazos_scraper import FeedWatcher
+
+# 1.5.2022, the start of the dataset
+virtual_start = 1651363200
+# lower is better for all of them, (relative, absolute) tolerance against the baseline
+tolerances = {
+    "requests_per_hour": (0.1, 0),
+    "missed_rate": (0, 0.005),
+    "lateness_p95": (0.5, 5),
+    "cpu_ms_per_poll": (0.5, 0.5),
+}
+
+
+class ScaledClock:
+    """
+    Virtual time running speed times faster than the wall clock.
+
+    Based on time.time(), so that the fake server process and the scraper agree on it.
+    """
+
+    def __init__(self, speed, real_start, virtual_start=virtual_start):
+        self.speed = speed
+        self.real_start = real_start
+        self.virtual_start = virtual_start
+
+    def time(self):
+        return self.virtual_start + (time.time() - self.real_start) * self.speed
+
+    def monotonic(self):
+        return self.time()
+
+    def real_seconds(self, seconds):
+        return seconds / self.speed
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds / self.speed)
+
+
+def make_feeds(scenario):
+    """
+    Synthetic feeds with Poisson arrivals, a daily cycle and random burst hours.
+
+    Every process calls this with the same scenario and gets the same arrivals.
+    """
+    rng = random.Random(scenario["seed"])
+    # a day of history so that the feeds are full at the start
+    start = virtual_start - 24 * 60 * 60
+    end = virtual_start + scenario["hours"] * 60 * 60
+    low, high = math.log(scenario["min_rate"]), math.log(scenario["max_rate"])
+    feeds = []
+    for i in range(scenario["feeds"]):
+        rate = math.exp(rng.uniform(low, high))
+        arrivals = []
+        for hour_start in range(start, end, 60 * 60):
+            hour = (hour_start // 3600) % 24
+            # quiet nights, busy evenings
+            hour_rate = rate * (1 + scenario["daily_amplitude"] * math.sin(2 * math.pi * (hour - 12) / 24))
+            if rng.random() < scenario["burst_probability"]:
+                hour_rate *= scenario["burst_factor"]
+            t = hour_start + rng.expovariate(hour_rate / 3600)
+            while t < hour_start + 60 * 60:
+                arrivals.append(int(t))
+                t += rng.expovariate(hour_rate / 3600)
+        feeds.append({"rub": f"r{i}", "cat": i, "rate": rate, "arrivals": arrivals})
+    return feeds
+
+
+def render_feed(feed, now):
+    # the newest feed_size entries published up to now, newest first like Bazos
+    seen = bisect.bisect_right(feed["arrivals"], now)
+    items = []
+    for n in range(seen - 1, max(seen - feed_size, 0) - 1, -1):
+        published = format_datetime(
+            datetime.fromtimestamp(feed["arrivals"][n], timezone.utc)
+        )
+        link = f"https://bench.bazos.cz/inzerat/{feed['cat'] * 10**7 + n}/inzerat-{n}.php"
+        items.append(
+            f"<item><title>{escape(feed['rub'])} inzerát {n}</title><link>{link}</link>"
+            f"<description>Popis {n}</description><pubDate>{published}</pubDate></item>"
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>'
+        f"<title>Bench {feed['rub']}</title><link>https://bench.bazos.cz/</link>"
+        "<description>Bench</description>" + "".join(items) + "</channel></rss>"
+    ).encode()
+
+
+class FakeBazosHandler(BaseHTTPRequestHandler):
+    # keep-alive like the real server, the fetcher reuses the connections
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        query = parse_qs(urlsplit(self.path).query)
+        feed = server.feeds.get((query.get("rub", [""])[0], query.get("cat", [""])[0]))
+        with server.lock:
+            draw = server.rng.random()
+        if feed is None:
+            self.respond(404, b"")
+        elif draw < server.scenario["forbidden_rate"]:
+            self.respond(403, b"")
+        elif draw < server.scenario["forbidden_rate"] + server.scenario["timeout_rate"]:
+            # longer than the fetcher waits
+            time.sleep(server.timeout * 2)
+            self.respond(200, render_feed(feed, server.clock.time()))
+        else:
+            self.respond(200, render_feed(feed, server.clock.time()))
+
+    def respond(self, status, body):
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/rss+xml; charset=UTF-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_server(scenario, clock, timeout, connection):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBazosHandler)
+    server.daemon_threads = True
+    server.scenario = scenario
+    server.clock = clock
+    server.timeout = timeout
+    server.feeds = {(feed["rub"], str(feed["cat"])): feed for feed in make_feeds(scenario)}
+    server.rng = random.Random(scenario["seed"] + 1)
+    server.lock = threading.Lock()
+    connection.send(server.server_address[1])
+    server.serve_forever()
+
+
+class RecordingWatcher(FeedWatcher):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statuses = Counter()
+        self.cpu = []
+        self.last_poll = None
+
+    def parse_new_entries(self):
+        polled = self.clock.time()
+        start = time.thread_time()
+        entries = super().parse_new_entries()
+        self.cpu.append(time.thread_time() - start)
+        self.statuses[self.last_status] += 1
+        if self.last_status in ("ok", "not_modified"):
+            # everything published before this poll should have been seen
+            self.last_poll = polled
+        return entries
+
+
+class RecordingWriter:
+    # stands in for EntryWriter, keeps the links instead of writing them
+    def __init__(self):
+        self.links = {}
+
+    def submit(self, output_path, entries, id=None, state=None):
+        self.links.setdefault(output_path, set()).update(entry["link"] for entry in entries)
+
+
+def run_benchmark(scenario, estimator="legacy", speed=600, requests_per_minute=5, burst=1, max_in_flight=8):
+    feeds = make_feeds(scenario)
+    # a request that would time out after 30 s
+    timeout = max(30 / speed, 0.5)
+    clock = ScaledClock(speed, time.time() + 2)
+
+    parent, child = multiprocessing.Pipe()
+    server = multiprocessing.Process(
+        target=run_server, args=(scenario, clock, timeout, child), daemon=True
+    )
+    server.start()
+    port = parent.recv()
+
+    fetcher = FeedFetcher("bazos-bench", max_connections=max_in_flight, timeout=timeout)
+    writer = RecordingWriter()
+    watchers = [
+        RecordingWatcher(
+            feed["rub"],
+            f"http://127.0.0.1:{port}/rss.php?rub={feed['rub']}&cat={feed['cat']}",
+            feed["rub"],
+            feed["rub"],
+            fetcher,
+            estimator=make_estimator(estimator, logging.getLogger(name=feed["rub"])),
+            clock=clock,
+        )
+        for feed in feeds
+    ]
+    for watcher in watchers:
+        # the first polls are due at the virtual start
+        watcher.last_update = virtual_start
+        watcher.next_update = virtual_start
+    limiter = HostRateLimiter(requests_per_minute / 60, burst, clock=clock)
+    engine = ScrapeEngine(
+        watchers,
+        limiter,
+        HostCircuitBreaker(clock=clock),
+        writer,
+        max_in_flight=max_in_flight,
+        report_interval=10 * scenario["hours"] * 60 * 60,
+        clock=clock,
+    )
+
+    async def run():
+        # the server started, wait for the virtual start
+        await asyncio.sleep(max(clock.real_start - time.time(), 0))
+        try:
+            await asyncio.wait_for(engine.run(), scenario["hours"] * 60 * 60 / speed)
+        except asyncio.TimeoutError:
+            pass
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    wall = time.perf_counter() - start
+    server.terminate()
+    fetcher.close()
+
+    missed = 0
+    expected = 0
+    for feed, watcher in zip(feeds, watchers):
+        if watcher.last_poll is None:
+            continue
+        seen = writer.links.get(watcher.output_path, set())
+        low = bisect.bisect_left(feed["arrivals"], virtual_start)
+        high = bisect.bisect_right(feed["arrivals"], watcher.last_poll)
+        for n in range(low, high):
+            expected += 1
+            if f"https://bench.bazos.cz/inzerat/{feed['cat'] * 10**7 + n}/inzerat-{n}.php" not in seen:
+                missed += 1
+
+    statuses = sum((watcher.statuses for watcher in watchers), Counter())
+    polls = sum(statuses.values())
+    cpu = [c for watcher in watchers for c in watcher.cpu]
+    lateness = sorted(engine.lateness)
+    return {
+        "estimator": estimator,
+        "wall_seconds": round(wall, 1),
+        "polls": polls,
+        "requests_per_hour": polls / scenario["hours"],
+        "statuses": dict(statuses),
+        "entries": expected,
+        "missed": missed,
+        "missed_rate": missed / max(expected, 1),
+        "lateness_mean": sum(lateness) / max(len(lateness), 1),
+        "lateness_p95": lateness[int(0.95 * (len(lateness) - 1))] if lateness else 0,
+        "lateness_max": lateness[-1] if lateness else 0,
+        "cpu_ms_per_poll": 1000 * sum(cpu) / max(len(cpu), 1),
+    }
+
+
+def regressions(result, baseline):
+    found = []
+    for key, (relative, absolute) in tolerances.items():
+        allowed = baseline[key] * (1 + relative) + absolute
+        if result[key] > allowed:
+            found.append(f"{key} {result[key]:.4g} > {allowed:.4g} (baseline {baseline[key]:.4g})")
+    return found
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser(
+        description="Measure the scraper scheduling against a local fake Bazos RSS server"
+    )
+    ap.add_argument("--feeds", type=int, default=50)
+    ap.add_argument("--hours", type=int, default=24, help="Virtual duration of the run")
+    ap.add_argument("--speed", type=float, default=600, help="Virtual seconds per real second")
+    ap.add_argument("--min-rate", type=float, default=0.5, help="Entries per hour of the slowest feed")
+    ap.add_argument("--max-rate", type=float, default=60, help="Entries per hour of the fastest feed")
+    ap.add_argument("--daily-amplitude", type=float, default=0.6)
+    ap.add_argument("--burst-probability", type=float, default=0.02, help="Share of hours with a burst")
+    ap.add_argument("--burst-factor", type=float, default=5)
+    ap.add_argument("--forbidden-rate", type=float, default=0.01, help="Share of requests answered with 403")
+    ap.add_argument("--timeout-rate", type=float, default=0.005, help="Share of requests that time out")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--requests-per-minute", type=float, default=5)
+    ap.add_argument("--max-in-flight", type=int, default=8)
+    ap.add_argument(
+        "--estimator",
+        type=str,
+        nargs="+",
+        default=["legacy"],
+        choices=list(estimators),
+    )
+    ap.add_argument("--baseline", type=str, default=None, help="JSON results to compare with")
+    ap.add_argument("--save-baseline", type=str, default=None, help="Write the results as a baseline")
+    args = ap.parse_args()
+
+    # the injected failures are counted in the report
+    logging.getLogger().setLevel(logging.CRITICAL)
+    scenario = {
+        "feeds": args.feeds,
+        "hours": args.hours,
+        "min_rate": args.min_rate,
+        "max_rate": args.max_rate,
+        "daily_amplitude": args.daily_amplitude,
+        "burst_probability": args.burst_probability,
+        "burst_factor": args.burst_factor,
+        "forbidden_rate": args.forbidden_rate,
+        "timeout_rate": args.timeout_rate,
+        "seed": args.seed,
+    }
+    results = {}
+    for name in args.estimator:
+        result = run_benchmark(
+            scenario,
+            name,
+            args.speed,
+            args.requests_per_minute,
+            max_in_flight=args.max_in_flight,
+        )
+        results[name] = result
+        print(
+            f"{name}: {result['requests_per_hour']:.1f} requests per hour, "
+            f"{result['missed']} of {result['entries']} entries missed ({result['missed_rate']:.2%}), "
+            f"lateness mean {result['lateness_mean']:.1f} s p95 {result['lateness_p95']:.1f} s max {result['lateness_max']:.1f} s, "
+            f"{result['cpu_ms_per_poll']:.2f} ms CPU per poll, statuses {result['statuses']}"
+        )
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"scenario": scenario, "results": results}, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["scenario"] != scenario:
+            print("The baseline was measured on another scenario")
+        failed = False
+        for name, result in results.items():
+            if name not in baseline["results"]:
+                continue
+            for regression in regressions(result, baseline["results"][name]):
+                print(f"{name}: regression, {regression}")
+                failed = True
+        if failed:
+            raise SystemExit(1)
+        print("No regressions against the baseline")
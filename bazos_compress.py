@@ -0,0 +1,168 @@
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+import gzip
+import io
+import json
+import os
+import zlib
+
+import pandas
+
+
+def index_path(gz_path):
+    return gz_path + ".index.json"
+
+
+class BlockWriter:
+    """
+    Writes a CSV as a multi-member gzip, one member per block of rows.
+
+    The whole file still decompresses with gunzip or pandas.read_csv, and the
+    index next to it (offset, length and datetime range of every block) lets
+    readers decompress only the blocks they need. The blocks are compressed by
+    the executor while the next ones are being written, zlib releases the GIL.
+    """
+
+    def __init__(self, path, header, executor, block_rows=200000, level=6, max_pending=8):
+        self.path = path
+        self.header = header
+        self.executor = executor
+        self.block_rows = block_rows
+        self.level = level
+        self.max_pending = max_pending
+        self.f = open(path, "wb")
+        self.offset = 0
+        self.blocks = []
+        self.pending = deque()
+        self.buffer = []
+        self.rows = 0
+        self.min_datetime = None
+        self.max_datetime = None
+
+    def write(self, text, datetime):
+        # text holds whole CSV records, datetime the UTC datetimes of its rows
+        if len(datetime) == 0 and not text:
+            return
+        self.buffer.append(text)
+        self.rows += len(datetime)
+        if len(datetime) > 0:
+            low, high = datetime.min().isoformat(), datetime.max().isoformat()
+            self.min_datetime = low if self.min_datetime is None else min(self.min_datetime, low)
+            self.max_datetime = high if self.max_datetime is None else max(self.max_datetime, high)
+        if self.rows >= self.block_rows:
+            self._submit()
+
+    def _submit(self):
+        data = "".join(self.buffer).encode()
+        block = {
+            "rows": self.rows,
+            "min_datetime": self.min_datetime,
+            "max_datetime": self.max_datetime,
+        }
+        self.pending.append((self.executor.submit(gzip.compress, data, self.level), block))
+        self.buffer = []
+        self.rows = 0
+        self.min_datetime = None
+        self.max_datetime = None
+        # bounded memory, wait for the oldest block when too many are in flight
+        while len(self.pending) > self.max_pending:
+            self._drain_one()
+
+    def _drain_one(self):
+        future, block = self.pending.popleft()
+        member = future.result()
+        self.f.write(member)
+        block["offset"] = self.offset
+        block["length"] = len(member)
+        self.offset += len(member)
+        self.blocks.append(block)
+
+    def close(self):
+        if self.buffer:
+            self._submit()
+        while self.pending:
+            self._drain_one()
+        self.f.close()
+        with open(index_path(self.path), "w") as f:
+            json.dump({"header": self.header, "blocks": self.blocks}, f, indent=1)
+        return self.offset
+
+
+def load_index(gz_path):
+    with open(index_path(gz_path)) as f:
+        return json.load(f)
+
+
+def read_blocks(gz_path, start=None, end=None, **read_csv_options):
+    """
+    Reads the rows of the blocks overlapping [start, end), UTC ISO strings like in the index.
+
+    The rows of a returned block outside of the range are not filtered out.
+    """
+    index = load_index(gz_path)
+    parts = [index["header"]]
+    with open(gz_path, "rb") as f:
+        for i, block in enumerate(index["blocks"]):
+            if block["rows"] == 0:
+                continue
+            if start is not None and block["max_datetime"] < start:
+                continue
+            if end is not None and block["min_datetime"] >= end:
+                continue
+            f.seek(block["offset"])
+            text = zlib.decompress(f.read(block["length"]), wbits=31).decode()
+            if i == 0:
+                # the first block starts with the header, so that gunzip gives the whole CSV
+                text = text[len(index["header"]) :]
+            parts.append(text)
+    return pandas.read_csv(io.StringIO("".join(parts)), **read_csv_options)
+
+
+def compress_csv(csv_path, executor, block_rows=200000, level=6):
+    gz_path = csv_path + ".gz"
+    chunks = pandas.read_csv(csv_path, dtype=str, keep_default_na=False, chunksize=block_rows)
+    writer = None
+    for df in chunks:
+        text = df.to_csv(index=False, header=writer is None)
+        if writer is None:
+            header = df.head(0).to_csv(index=False)
+            writer = BlockWriter(gz_path, header, executor, block_rows, level)
+        writer.write(text, pandas.to_datetime(df["datetime"], utc=True))
+    if writer is None:
+        return None
+    size = writer.close()
+    print(f"Compressed {csv_path} to {size} bytes in {len(writer.blocks)} blocks")
+    return gz_path
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser(
+        description="Compress the anonymized CSVs into block gzip files with an index"
+    )
+    ap.add_argument(
+        "csv_files",
+        type=str,
+        nargs="*",
+        help="CSVs to compress, all of anon_output_merged by default",
+    )
+    ap.add_argument(
+        "--block-rows",
+        type=int,
+        default=200000,
+        help="Number of rows in one independently compressed block",
+    )
+    ap.add_argument("--level", type=int, default=6, help="gzip compression level")
+    ap.add_argument(
+        "--threads",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of blocks compressed at once",
+    )
+    args = ap.parse_args()
+
+    csv_files = args.csv_files or sorted(glob("anon_output_merged/*.csv"))
+    with ThreadPoolExecutor(args.threads) as executor:
+        for csv_file in csv_files:
+            compress_csv(csv_file, executor, args.block_rows, args.level)
@@ -0,0 +1,143 @@
+from argparse import ArgumentParser
+from glob import glob
+import os
+import shutil
+
+import pandas
+import pyarrow
+import pyarrow.parquet
+
+from bazos_manifest import section_pattern
+from bazos_postings import PostingBatch
+
+dataset_root = "parquet_dataset"
+
+
+def to_table(df, section):
+    datetime = pandas.to_datetime(df["datetime"], utc=True)
+    df = pandas.DataFrame(
+        {
+            "title": df["title"],
+            "price": df["price"].astype("float64"),
+            "price_string": df["price_string"],
+            "link": df["link"],
+            "datetime": datetime,
+            "section": section,
+            "month": datetime.dt.strftime("%Y-%m"),
+        }
+    )
+    # sorted row groups let the datetime statistics skip most of a partition
+    df = df.sort_values("datetime", kind="stable")
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    return table.set_column(
+        table.schema.get_field_index("price_string"),
+        "price_string",
+        table["price_string"].dictionary_encode(),
+    )
+
+
+def write_parquet(csv_file, section, root=dataset_root, chunksize=1000000, append=False):
+    """
+    Writes an anonymized section CSV into the dataset partitioned by section and month.
+
+    Without append the partitions of the section are replaced. The files are named
+    after the CSV, so writing an incremental part again overwrites its own files.
+    """
+    if not append:
+        shutil.rmtree(os.path.join(root, f"section={section}"), ignore_errors=True)
+    stem = os.path.splitext(os.path.basename(csv_file))[0]
+    total = 0
+    chunks = pandas.read_csv(
+        csv_file, dtype={"title": str, "price_string": str, "link": str}, chunksize=chunksize
+    )
+    for i, df in enumerate(chunks):
+        pyarrow.parquet.write_to_dataset(
+            to_table(df, section),
+            root,
+            partition_cols=["section", "month"],
+            basename_template=f"{stem}-{i}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        total += len(df)
+    print(f"Wrote {total} rows of {csv_file} to {root}")
+    return total
+
+
+def load(
+    root=dataset_root,
+    sections=None,
+    columns=None,
+    start=None,
+    end=None,
+    tz="Europe/Prague",
+    compact=False,
+):
+    """
+    Loads the dataset into a DataFrame like the one the example notebook builds from the CSV.
+
+    Only the given columns are read, the section and month partitions outside of
+    the sections and the [start, end) date range are skipped without opening them.
+    start and end without a timezone are in tz. With compact all the columns are
+    returned as a PostingBatch instead of a DataFrame.
+    """
+    if compact:
+        columns = None
+    filters = []
+    if sections is not None:
+        filters.append(("section", "in", list(sections)))
+    for op, bound in ((">=", start), ("<", end)):
+        if bound is None:
+            continue
+        bound = pandas.Timestamp(bound)
+        if bound.tzinfo is None:
+            bound = bound.tz_localize(tz)
+        bound = bound.tz_convert("UTC")
+        # the month partition of the bound itself is read, it is only partly in range
+        filters.append(("month", op if op == ">=" else "<=", bound.strftime("%Y-%m")))
+        filters.append(("datetime", op, bound))
+
+    table = pyarrow.parquet.read_table(
+        root,
+        columns=columns,
+        filters=filters or None,
+        memory_map=True,
+        partitioning="hive",
+    )
+    df = table.to_pandas()
+    if compact:
+        return PostingBatch.from_frame(df)
+    if "datetime" in df:
+        df["datetime"] = df["datetime"].dt.tz_convert(tz)
+    return df
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser(
+        description="Convert the anonymized section CSVs to a Parquet dataset partitioned by section and month"
+    )
+    ap.add_argument(
+        "csv_files",
+        type=str,
+        nargs="*",
+        help="Anonymized CSVs, all of anon_output_merged by default",
+    )
+    ap.add_argument("--root", type=str, default=dataset_root)
+    ap.add_argument(
+        "--chunksize",
+        type=int,
+        default=1000000,
+        help="Number of rows read at once",
+    )
+    args = ap.parse_args()
+
+    csv_files = args.csv_files or sorted(glob("anon_output_merged/section_*.csv"))
+    replaced = set()
+    total = 0
+    for csv_file in csv_files:
+        section = section_pattern.search(csv_file).group(1)
+        # the first file of a section replaces its partitions, the others are added
+        total += write_parquet(
+            csv_file, section, args.root, args.chunksize, append=section in replaced
+        )
+        replaced.add(section)
+    print(f"Wrote {total} rows")
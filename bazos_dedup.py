@@ -0,0 +1,169 @@
+from collections import Counter
+import os
+import tempfile
+
+import numpy
+import pandas
+
+ad_id_pattern = r"/inzerat/(\d+)/"
+
+
+def ad_ids(links):
+    # -1 for links without an ad id
+    ids = links.str.extract(ad_id_pattern, expand=False)
+    return ids.fillna(-1).astype("int64").to_numpy()
+
+
+class AdIdSet:
+    """
+    Set of ad ids kept as a bitmap indexed by the id.
+
+    The ids are sequential numbers (around 150M in 2022), so one bit per possible
+    id takes tens of MB however many rows are deduplicated.
+    """
+
+    def __init__(self):
+        self.bits = numpy.zeros(0, dtype=numpy.uint8)
+
+    def _grow(self, max_id):
+        needed = max_id // 8 + 1
+        if needed > len(self.bits):
+            size = max(needed, 2 * len(self.bits))
+            self.bits = numpy.concatenate(
+                [self.bits, numpy.zeros(size - len(self.bits), dtype=numpy.uint8)]
+            )
+
+    @classmethod
+    def load(cls, path):
+        ids = cls()
+        ids.bits = numpy.load(path)
+        return ids
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            numpy.save(f, self.bits)
+
+    def __len__(self):
+        return int(numpy.unpackbits(self.bits).sum())
+
+    def add_new(self, ids):
+        """
+        Adds the ids and returns a mask of the ones that were not seen before.
+
+        Only the first occurrence of an id repeated within ids counts as new.
+        """
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+        new = numpy.zeros(len(ids), dtype=bool)
+        if len(ids) == 0:
+            return new
+        unique, first = numpy.unique(ids, return_index=True)
+        self._grow(int(unique[-1]))
+        byte = unique >> 3
+        bit = (1 << (unique & 7)).astype(numpy.uint8)
+        unseen = (self.bits[byte] & bit) == 0
+        new[first[unseen]] = True
+        # the unique ids of one byte are set one by one
+        numpy.bitwise_or.at(self.bits, byte[unseen], bit[unseen])
+        return new
+
+
+def earliest_per_id(ids, epochs):
+    # the ids sorted and the smallest epoch of each, the sort is stable
+    order = numpy.lexsort((epochs, ids))
+    ids = ids[order]
+    first = numpy.ones(len(ids), dtype=bool)
+    first[1:] = ids[1:] != ids[:-1]
+    return ids[first], epochs[order][first]
+
+
+class EarliestSightings:
+    """
+    The earliest epoch of every ad id of a section, the first pass of the dedup.
+
+    The (ad id, epoch) pairs of every batch, reduced to one per id, are spilled to
+    files in a temporary directory and sorted once in finish() through a memmap,
+    so the rows of the section are never held in memory.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = tempfile.mkdtemp(prefix="bazos_dedup_", dir=directory)
+        self.id_file = open(os.path.join(self.directory, "ids.bin"), "wb")
+        self.epoch_file = open(os.path.join(self.directory, "epochs.bin"), "wb")
+        self.count = 0
+        self.ids = numpy.zeros(0, dtype=numpy.int64)
+        self.epochs = numpy.zeros(0, dtype=numpy.int64)
+
+    def add(self, ids, epochs):
+        has_id = ids >= 0
+        ids, epochs = earliest_per_id(ids[has_id], epochs[has_id])
+        ids.tofile(self.id_file)
+        epochs.tofile(self.epoch_file)
+        self.count += len(ids)
+
+    def finish(self):
+        self.id_file.close()
+        self.epoch_file.close()
+        if self.count:
+            ids = numpy.memmap(self.id_file.name, dtype=numpy.int64, mode="r")
+            epochs = numpy.memmap(self.epoch_file.name, dtype=numpy.int64, mode="r")
+            self.ids, self.epochs = earliest_per_id(ids, epochs)
+            del ids, epochs
+        os.remove(self.id_file.name)
+        os.remove(self.epoch_file.name)
+        os.rmdir(self.directory)
+
+    def earliest(self, ids):
+        # the largest int64 for ids not seen in the first pass
+        earliest = numpy.full(len(ids), numpy.iinfo(numpy.int64).max)
+        if len(self.ids):
+            i = numpy.searchsorted(self.ids, ids).clip(max=len(self.ids) - 1)
+            found = self.ids[i] == ids
+            earliest[found] = self.epochs[i[found]]
+        return earliest
+
+
+class Deduplicator:
+    """
+    Drops repeated ads across the scraped files of a section, keeping the earliest sighting.
+
+    The files are read twice: observe() sees every row and finds the earliest epoch
+    of each ad id, keep() then keeps the first row with that epoch. Ids in seen,
+    written by a previous incremental run, are dropped. Links without an ad id are
+    always kept. The duplicates are counted per source file.
+    """
+
+    def __init__(self, seen=None, directory=None):
+        self.seen = seen if seen is not None else AdIdSet()
+        self.sightings = EarliestSightings(directory)
+        self.duplicates = Counter()
+        self.without_id = 0
+        self.rows = 0
+
+    def observe(self, links, epochs):
+        ids = ad_ids(pandas.Series(links, dtype="object"))
+        self.sightings.add(ids, numpy.asarray(epochs, dtype=numpy.int64))
+
+    def finish(self):
+        self.sightings.finish()
+
+    def keep(self, links, sources, epochs):
+        ids = ad_ids(pandas.Series(links, dtype="object"))
+        epochs = numpy.asarray(epochs, dtype=numpy.int64)
+        has_id = ids >= 0
+        keep = ~has_id
+        # rows appended after the first pass have no earliest epoch and count as earliest
+        earliest = numpy.flatnonzero(
+            has_id & (epochs <= self.sightings.earliest(ids))
+        )
+        keep[earliest] = self.seen.add_new(ids[earliest])
+        for i in numpy.flatnonzero(~keep):
+            self.duplicates[sources[i]] += 1
+        self.without_id += int((~has_id).sum())
+        self.rows += len(ids)
+        return keep
+
+    def report(self):
+        dropped = sum(self.duplicates.values())
+        print(f"Dropped {dropped} duplicates of {self.rows} rows, {self.without_id} rows without an ad id")
+        for source, count in self.duplicates.most_common():
+            print(f"  {source}: {count} duplicates")
@@ -0,0 +1,355 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from urllib.parse import urlparse
+
+
+class SystemClock:
+    # the scheduling reads the time through a clock so that the benchmark can speed it up
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def real_seconds(self, seconds):
+        return seconds
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+
+system_clock = SystemClock()
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=1, clock=system_clock):
+        # rate is in tokens per second, capacity is the allowed burst
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self.clock.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # the lock makes the waiting requests take the tokens in FIFO order
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await self.clock.sleep((1 - self.tokens) / self.rate)
+
+
+class HostRateLimiter:
+    def __init__(self, rate, capacity=1, clock=system_clock):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.buckets = {}
+
+    def bucket(self, url):
+        host = urlparse(url).hostname
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.capacity, self.clock)
+        return self.buckets[host]
+
+    async def acquire(self, url):
+        await self.bucket(url).acquire()
+
+
+class CircuitBreaker:
+    def __init__(
+        self, threshold=5, cooldown=300, max_cooldown=2 * 60 * 60, clock=system_clock
+    ):
+        # only failures that mean the whole host is refusing us open the breaker
+        self.failure_statuses = {"forbidden", "network_error", "server_error"}
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.consecutive_failures = 0
+        self.open_until = 0
+        self.clock = clock
+        self.logger = logging.getLogger(name="circuit_breaker")
+
+    def record(self, status):
+        if status not in self.failure_statuses:
+            if status == "ok" and self.consecutive_failures:
+                self.logger.info(f"Host responds again, closing the circuit breaker")
+                self.consecutive_failures = 0
+                self.cooldown = self.base_cooldown
+            return
+
+        self.consecutive_failures += 1
+        if self.consecutive_failures < self.threshold:
+            return
+
+        # once open, every failed probe after the cooldown reopens it for longer
+        now = self.clock.time()
+        if now >= self.open_until:
+            self.open_until = now + self.cooldown
+            self.logger.warning(
+                f"{self.consecutive_failures} consecutive failures, pausing all requests for {self.cooldown} seconds"
+            )
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+
+    async def wait(self):
+        wait = self.open_until - self.clock.time()
+        if wait > 0:
+            await self.clock.sleep(wait)
+
+
+class HostCircuitBreaker:
+    def __init__(self, threshold=5, cooldown=300, clock=system_clock):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.breakers = {}
+
+    def breaker(self, url):
+        host = urlparse(url).hostname
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(
+                self.threshold, self.cooldown, clock=self.clock
+            )
+        return self.breakers[host]
+
+    def record(self, url, status):
+        self.breaker(url).record(status)
+
+    async def wait(self, url):
+        await self.breaker(url).wait()
+
+
+class DeadlineScheduler:
+    def __init__(self, watchers=()):
+        # the counter breaks ties so that watchers themselves are never compared
+        self.counter = itertools.count()
+        # the counter of the only live entry of each watcher, older entries are stale
+        self.entries = {}
+        self.heap = []
+        for watcher in watchers:
+            self.push(watcher)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def push(self, watcher):
+        entry = next(self.counter)
+        self.entries[watcher] = entry
+        heapq.heappush(self.heap, (watcher.next_update, entry, watcher))
+
+    def discard(self, watcher):
+        self.entries.pop(watcher, None)
+
+    def next_deadline(self):
+        while self.heap and self.entries.get(self.heap[0][2]) != self.heap[0][1]:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+        return self.heap[0][0]
+
+    def pop_due(self, now):
+        while self.heap and self.heap[0][0] <= now:
+            deadline, entry, watcher = heapq.heappop(self.heap)
+            # removed and rescheduled watchers leave stale entries, dropped lazily
+            if self.entries.get(watcher) != entry:
+                continue
+            del self.entries[watcher]
+            return deadline, watcher
+        return None
+
+
+class ScrapeEngine:
+    def __init__(
+        self,
+        watchers,
+        limiter,
+        breaker,
+        writer,
+        planner=None,
+        lease_table=None,
+        state_store=None,
+        max_in_flight=8,
+        report_interval=600,
+        plan_interval=60 * 60,
+        clock=system_clock,
+    ):
+        self.lease_table = lease_table
+        self.state_store = state_store
+        if lease_table is None:
+            self.watchers = watchers
+        else:
+            # the watchers are polled only while this worker holds their lease
+            self.candidates = {watcher.id: watcher for watcher in watchers}
+            self.watchers = []
+        self.scheduler = DeadlineScheduler(self.watchers)
+        self.limiter = limiter
+        self.breaker = breaker
+        self.writer = writer
+        self.planner = planner
+        self.plan_interval = plan_interval
+        self.max_in_flight = max_in_flight
+        self.report_interval = report_interval
+        self.clock = clock
+        self.lateness = []
+        self.tasks = set()
+        self.polling = set()
+        self.logger = logging.getLogger(name="engine")
+
+    async def poll(self, watcher):
+        try:
+            new_entries = await asyncio.to_thread(watcher.parse_new_entries)
+        except Exception:
+            self.logger.exception(f"Unexpected error while polling {watcher.url}")
+            watcher.next_update = self.clock.time() + watcher.interval
+            new_entries = []
+        finally:
+            self.in_flight.release()
+
+        self.polling.discard(watcher)
+        self.breaker.record(watcher.url, watcher.last_status)
+        # the writer checkpoints the state only once the entries are flushed
+        self.writer.submit(
+            watcher.output_path, new_entries, watcher.id, watcher.to_state()
+        )
+
+        if not watcher.removed:
+            self.scheduler.push(watcher)
+        self.wakeup.set()
+
+    def add_watcher(self, watcher):
+        watcher.removed = False
+        self.watchers.append(watcher)
+        # a watcher re-added during its poll is pushed when the poll finishes
+        if watcher not in self.polling:
+            self.scheduler.push(watcher)
+        self.wakeup.set()
+
+    def remove_watcher(self, watcher):
+        watcher.removed = True
+        self.watchers.remove(watcher)
+        self.scheduler.discard(watcher)
+
+    async def lease(self):
+        while True:
+            held = await asyncio.to_thread(
+                self.lease_table.sync, list(self.candidates)
+            )
+            current = {watcher.id for watcher in self.watchers}
+            for id in current - held:
+                self.remove_watcher(self.candidates[id])
+            for id in held - current:
+                watcher = self.candidates[id]
+                # another worker may have polled it, continue from its checkpoint
+                state = self.state_store.load(id)
+                if state is not None:
+                    watcher.load_state(state)
+                self.add_watcher(watcher)
+            if held != current:
+                self.logger.info(
+                    f"Holding leases of {len(held)} of {len(self.candidates)} watchers"
+                )
+            await asyncio.sleep(self.lease_table.ttl / 3)
+
+    async def plan(self):
+        while True:
+            await self.clock.sleep(self.plan_interval)
+            added, removed = self.planner.plan(self.clock.time())
+            for watcher in removed:
+                self.remove_watcher(watcher)
+            for watcher in added:
+                self.add_watcher(watcher)
+            if added or removed:
+                self.logger.info(
+                    f"Feed plan changed, {len(added)} watchers added, {len(removed)} removed, {len(self.watchers)} in total"
+                )
+
+    async def dispatch(self):
+        while True:
+            self.wakeup.clear()
+            due = self.scheduler.pop_due(self.clock.time())
+            if due is None:
+                next_deadline = self.scheduler.next_deadline()
+                timeout = None
+                if next_deadline is not None:
+                    timeout = self.clock.real_seconds(
+                        max(next_deadline - self.clock.time(), 0)
+                    )
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            deadline, watcher = due
+            await self.in_flight.acquire()
+            await self.breaker.wait(watcher.url)
+            await self.limiter.acquire(watcher.url)
+            if watcher.removed or watcher in self.scheduler.entries:
+                # the lease was lost or the planner removed it while waiting, a re-added
+                # watcher is polled from its new entry
+                self.in_flight.release()
+                continue
+
+            lateness = self.clock.time() - deadline
+            self.lateness.append(lateness)
+            watcher.logger.info(f"Polling {lateness:.2f} seconds after the deadline")
+
+            self.polling.add(watcher)
+            task = asyncio.create_task(self.poll(watcher))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def report(self):
+        while True:
+            await self.clock.sleep(self.report_interval)
+            lateness = sorted(self.lateness)
+            self.lateness = []
+            self.logger.info(
+                f"Sent {len(lateness)} requests in the last {self.report_interval} seconds"
+            )
+            if lateness:
+                mean = sum(lateness) / len(lateness)
+                p95 = lateness[int(0.95 * (len(lateness) - 1))]
+                self.logger.info(
+                    f"Poll lateness mean {mean:.2f} s, p95 {p95:.2f} s, max {lateness[-1]:.2f} s"
+                )
+
+            num_fastest_watchers = sum(
+                1 if watcher.interval == 600 else 0 for watcher in self.watchers
+            )
+            self.logger.info(
+                f"We have {num_fastest_watchers} watchers refreshing every 600 seconds"
+            )
+
+            polls = sum(watcher.stats["polls"] for watcher in self.watchers)
+            overflows = sum(watcher.stats["overflows"] for watcher in self.watchers)
+            self.logger.info(
+                f"{overflows} of {polls} successful polls overflowed the feed since the start"
+            )
+
+            if lateness and lateness[-1] > self.report_interval:
+                self.logger.warning(
+                    f"Some polls were more than {self.report_interval} seconds behind their schedule"
+                )
+
+    async def run(self):
+        self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        self.wakeup = asyncio.Event()
+        tasks = [self.report(), self.dispatch()]
+        if self.planner is not None:
+            tasks.append(self.plan())
+        if self.lease_table is not None:
+            tasks.append(self.lease())
+        await asyncio.gather(*tasks)
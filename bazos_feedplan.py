@@ -0,0 +1,722 @@
+import calendar
+import logging
+import os
+
+from bazos_interval import feed_size, max_interval, min_interval
+
+sections = [
+    "zv",
+    "de",
+    "re",
+    "pr",
+    "au",
+    "mt",
+    "st",
+    "du",
+    "pc",
+    "mo",
+    "fo",
+    "el",
+    "sp",
+    "hu",
+    "vs",
+    "kn",
+    "na",
+    "ob",
+    "sl",
+    "os",
+]
+# sections polled per category until the planner learns otherwise
+default_split_sections = ["de", "au", "du", "pc", "el", "sp", "na", "ob", "os"]
+categories = {
+    "zv": [
+        (44, "Akvarijní rybičky"),
+        (45, "Drobní savci"),
+        (47, "Kočky"),
+        (46, "Koně"),
+        (61, "Koně - potřeby"),
+        (48, "Psi"),
+        (49, "Ptactvo"),
+        (50, "Terarijní zvířata"),
+        (51, "Ostatní domácí zvířata"),
+        (53, "Krytí"),
+        (427, "Ztraceni a nalezeni"),
+        (52, "Chovatelské potřeby"),
+        (55, "Drůbež"),
+        (56, "Králíci"),
+        (57, "Ovce a kozy"),
+        (58, "Prasata"),
+        (59, "Skot"),
+        (60, "Ostatní hospodářská zvířata"),
+    ],
+    "de": [
+        (117, "Autosedačky"),
+        (118, "Baby monitory, chůvičky"),
+        (119, "Hračky"),
+        (120, "Chodítka a hopsadla"),
+        (121, "Kočárky"),
+        (122, "Kojenecké potřeby"),
+        (456, "Kola"),
+        (123, "Nábytek pro děti"),
+        (124, "Nosítka"),
+        (127, "Odrážedla"),
+        (128, "Sedačky na kolo"),
+        (129, "Sportovní potřeby"),
+        (130, "Školní potřeby"),
+        (132, "Ostatní"),
+        (133, "Body, dupačky a overaly"),
+        (134, "Bundy a kabátky"),
+        (135, "Čepice a kloboučky"),
+        (136, "Kalhoty, kraťasy a tepláky"),
+        (137, "Kombinézy"),
+        (442, "Komplety"),
+        (138, "Mikiny a svetry"),
+        (126, "Obuv"),
+        (139, "Plavky"),
+        (140, "Ponožky a punčocháče"),
+        (141, "Pyžámka a župánky"),
+        (142, "Rukavice a šály"),
+        (143, "Spodní prádlo"),
+        (144, "Sukýnky a šatičky"),
+        (145, "Trička a košile"),
+        (125, "Ostatní oblečení"),
+    ],
+    "pr": [
+        (277, "Administrativa"),
+        (300, "Brigády"),
+        (278, "Chemie a potravinářství"),
+        (279, "Doprava a logistika"),
+        (280, "Finance a ekonomika"),
+        (281, "IT a telekomunikace"),
+        (283, "Management"),
+        (282, "Marketing a reklama"),
+        (284, "Obchod a prodej"),
+        (285, "Obrana a bezpečnost"),
+        (286, "Pohostinství a ubytování"),
+        (287, "Práce v domácnosti"),
+        (288, "Právo, legislativa"),
+        (289, "Průmysl a výroba"),
+        (290, "Řemeslné práce"),
+        (291, "Servis a služby"),
+        (293, "Stavebnictví"),
+        (294, "Technika a energetika"),
+        (295, "Tisk a polygrafie"),
+        (296, "Výzkum a vývoj"),
+        (297, "Vzdělávání a personalistika"),
+        (298, "Zdravotnictví"),
+        (299, "Zemědělství"),
+        (301, "Ostatní"),
+    ],
+    "au": [
+        (443, "Alfa Romeo"),
+        (80, "Audi"),
+        (81, "BMW"),
+        (396, "Chevrolet"),
+        (82, "Citroën"),
+        (461, "Dacia"),
+        (83, "Fiat"),
+        (84, "Ford"),
+        (395, "Honda"),
+        (85, "Hyundai"),
+        (397, "Kia"),
+        (86, "Mazda"),
+        (87, "Mercedes-Benz"),
+        (445, "Mitsubishi"),
+        (88, "Nissan"),
+        (89, "Opel"),
+        (90, "Peugeot"),
+        (91, "Renault"),
+        (92, "Seat"),
+        (398, "Suzuki"),
+        (93, "Škoda"),
+        (94, "Toyota"),
+        (95, "Volkswagen"),
+        (96, "Volvo"),
+        (98, "Havarovaná"),
+        (97, "Ostatní značky"),
+        (99, "Náhradní díly"),
+        (106, "Pneumatiky, kola"),
+        (428, "Příslušenství"),
+        (107, "Tuning"),
+        (108, "Veteráni"),
+        (109, "Autobusy"),
+        (101, "Dodávky"),
+        (110, "Karavany, vozíky"),
+        (102, "Mikrobusy"),
+        (111, "Nákladní auta"),
+        (100, "Pick-up"),
+        (103, "Ostatní užitková"),
+        (104, "Havarovaná užitková"),
+        (105, "Náhradní díly užitková"),
+    ],
+    "mt": [
+        (191, "Cestovní motocykly"),
+        (193, "Chopper"),
+        (192, "Čtyřkolky"),
+        (194, "Enduro"),
+        (195, "Minibike"),
+        (196, "Mopedy"),
+        (197, "Silniční motocykly"),
+        (198, "Skútry"),
+        (200, "Skútry sněžné"),
+        (199, "Skútry vodní"),
+        (201, "Tříkolky"),
+        (202, "Veteráni"),
+        (203, "Náhradní díly"),
+        (204, "Oblečení, obuv, helmy"),
+        (205, "Ostatní"),
+    ],
+    "st": [
+        (174, "Čerpadla"),
+        (175, "Čistící stroje"),
+        (176, "Dřevoobráběcí stroje"),
+        (177, "Generátory"),
+        (178, "Historické stroje"),
+        (179, "Kovoobráběcí stroje"),
+        (180, "Motory"),
+        (181, "Potravinářské stroje"),
+        (182, "Skladová technika"),
+        (183, "Stavební stroje"),
+        (184, "Textilní stroje"),
+        (185, "Tiskařské stroje"),
+        (186, "Vybavení provozoven"),
+        (187, "Výrobní linky"),
+        (188, "Zemědělská technika"),
+        (189, "Náhradní díly"),
+        (190, "Ostatní"),
+    ],
+    "du": [
+        (302, "Bazény"),
+        (303, "Čerpadla"),
+        (451, "Dveře, vrata"),
+        (304, "Klimatizace"),
+        (305, "Kotle, Kamna, Bojlery"),
+        (306, "Malotraktory, Kultivátory"),
+        (307, "Míchačky"),
+        (308, "Nářadí"),
+        (452, "Okna"),
+        (453, "Pily"),
+        (309, "Radiátory"),
+        (310, "Rostliny"),
+        (311, "Sekačky"),
+        (312, "Sněžná technika"),
+        (313, "Stavební materiál"),
+        (314, "Vybavení dílen"),
+        (315, "Vysavače/Foukače"),
+        (316, "Zahradní grily"),
+        (318, "Zahradní technika"),
+        (319, "Ostatní"),
+    ],
+    "pc": [
+        (27, "Chladiče"),
+        (1, "DVD, Blu-ray mechaniky"),
+        (32, "GPS navigace"),
+        (4, "Grafické karty"),
+        (5, "Hard disky, SSD"),
+        (25, "Herní konzole"),
+        (29, "Herní zařízení"),
+        (30, "Hry"),
+        (6, "Klávesnice, myši"),
+        (7, "Kopírovací stroje"),
+        (9, "LCD monitory"),
+        (2, "Modemy"),
+        (26, "MP3 přehrávače"),
+        (10, "Notebooky"),
+        (11, "Paměti"),
+        (12, "PC, Počítače"),
+        (13, "Procesory"),
+        (15, "Scanery"),
+        (14, "Síťové prvky"),
+        (16, "Skříně, zdroje"),
+        (17, "Software"),
+        (31, "Spotřební materiál"),
+        (24, "Tablety, E-čtečky"),
+        (18, "Tiskárny"),
+        (28, "Wireless, WiFi"),
+        (19, "Základní desky"),
+        (20, "Záložní zdroje"),
+        (21, "Zvukové karty"),
+        (22, "Ostatní"),
+    ],
+    "mo": [
+        (439, "Apple"),
+        (440, "HTC"),
+        (347, "Huawei, Honor"),
+        (343, "LG"),
+        (344, "Motorola, Lenovo"),
+        (345, "Nokia, Microsoft"),
+        (346, "Samsung"),
+        (348, "Sony"),
+        (455, "Xiaomi"),
+        (349, "Ostatní značky"),
+        (353, "Baterie"),
+        (350, "Bezdrátové telefony"),
+        (354, "Datové kabely"),
+        (351, "Faxy"),
+        (355, "Headsety"),
+        (356, "HF Sady do auta"),
+        (454, "Chytré hodinky"),
+        (444, "Kryty"),
+        (357, "Nabíječky"),
+        (358, "Paměťové karty"),
+        (352, "Stolní telefony"),
+        (360, "Ostatní"),
+    ],
+    "fo": [
+        (447, "Analogové fotoaparáty"),
+        (146, "Digitální fotoaparáty"),
+        (460, "Drony"),
+        (148, "Videokamery"),
+        (147, "Zrcadlovky"),
+        (149, "Baterie"),
+        (446, "Blesky a osvětlení"),
+        (150, "Brašny a pouzdra"),
+        (151, "Datové kabely"),
+        (152, "Filtry"),
+        (153, "Nabíječky baterií"),
+        (154, "Objektivy"),
+        (155, "Paměťové karty"),
+        (156, "Stativy"),
+        (157, "Ostatní"),
+    ],
+    "el": [
+        (371, "Autorádia"),
+        (361, "Digestoře"),
+        (373, "Domácí kina"),
+        (382, "Epilátory, Depilátory"),
+        (383, "Fény, Kulmy"),
+        (374, "Hifi systémy, Rádia"),
+        (384, "Holící strojky"),
+        (385, "Kávovary"),
+        (363, "Ledničky"),
+        (364, "Mikrovlnné trouby"),
+        (365, "Mrazáky"),
+        (366, "Myčky"),
+        (386, "Nabíječky baterií"),
+        (367, "Pračky"),
+        (376, "Projektory"),
+        (377, "Repro soustavy"),
+        (387, "Ruční šlehače, Mixéry"),
+        (389, "Šicí stroje"),
+        (372, "Sluchátka"),
+        (368, "Sporáky"),
+        (369, "Sušičky"),
+        (388, "Svítidla, Lampy"),
+        (378, "Televize"),
+        (379, "Video, DVD přehrávače"),
+        (390, "Vysavače"),
+        (391, "Vysílačky"),
+        (380, "Zesilovače"),
+        (392, "Zvlhčovače vzduchu"),
+        (393, "Žehličky"),
+        (370, "Ostatní - bílá"),
+        (381, "Ostatní audio video"),
+        (394, "Ostatní drobné"),
+    ],
+    "sp": [
+        (243, "Fitness, jogging"),
+        (245, "Fotbal"),
+        (244, "Golf"),
+        (246, "In-line, Skateboarding"),
+        (242, "Kempink"),
+        (448, "Letectví"),
+        (247, "Míčové hry"),
+        (248, "Myslivost, lov"),
+        (249, "Paintball, airsoft"),
+        (250, "Rybaření"),
+        (251, "Společenské hry"),
+        (252, "Tenis, squash, badminton"),
+        (253, "Turistika, horolezectví"),
+        (254, "Vodní sporty, potápění"),
+        (255, "Vše ostatní"),
+        (450, "Koloběžky"),
+        (256, "Horská kola"),
+        (257, "Silniční kola"),
+        (258, "Součástky a díly"),
+        (259, "Ostatní cyklistika"),
+        (449, "Běžkování"),
+        (260, "Lyžování"),
+        (463, "Skialpy"),
+        (261, "Snowboarding"),
+        (262, "Hokej, bruslení"),
+        (263, "Ostatní zimní"),
+    ],
+    "hu": [
+        (158, "Bicí nástroje"),
+        (159, "Dechové nástroje"),
+        (160, "Klávesové nástroje"),
+        (161, "Smyčcové nástroje"),
+        (162, "Strunné nástroje"),
+        (163, "Ostatní nástroje"),
+        (164, "DVD, CD, MC, LP"),
+        (165, "Hudebníci a skupiny"),
+        (166, "Koncerty"),
+        (168, "Noty, texty"),
+        (169, "Světelná technika"),
+        (171, "Zkušebny"),
+        (172, "Zvuková technika"),
+        (173, "Ostatní"),
+    ],
+    "vs": [
+        (268, "Dálniční známky"),
+        (269, "Dárkové poukazky"),
+        (276, "Jízdenky"),
+        (264, "Letenky"),
+        (274, "Permanentky"),
+        (265, "Divadlo"),
+        (266, "Festivaly"),
+        (267, "Hudba, Koncerty"),
+        (270, "Pro děti"),
+        (271, "Společenské akce"),
+        (272, "Sport"),
+        (273, "Výstavy"),
+        (275, "Ostatní"),
+    ],
+    "kn": [
+        (320, "Beletrie"),
+        (321, "Časopisy"),
+        (342, "Cizojazyčná literatura"),
+        (322, "Detektivky"),
+        (323, "Dětská literatura"),
+        (324, "Drama"),
+        (325, "Encyklopedie"),
+        (326, "Esoterika"),
+        (327, "Historické romány"),
+        (328, "Hobby, odborné knihy"),
+        (329, "Kuchařky"),
+        (330, "Mapy, cestovní průvodci"),
+        (332, "Počítačová literatura"),
+        (333, "Pro mládež"),
+        (334, "Romány pro ženy"),
+        (335, "Sci-fi, Fantasy"),
+        (341, "Učebnice, skripta - Jazykové"),
+        (337, "Učebnice, skripta - SŠ"),
+        (336, "Učebnice, skripta - VŠ"),
+        (340, "Učebnice, skripta - ZŠ"),
+        (338, "Zábavná"),
+        (339, "Zdravý životní styl"),
+        (331, "Ostatní"),
+    ],
+    "na": [
+        (206, "Jídelní kouty"),
+        (207, "Knihovny"),
+        (208, "Koberce a podlah. krytina"),
+        (209, "Koupelny"),
+        (210, "Křesla a gauče"),
+        (211, "Kuchyně"),
+        (212, "Lampy, osvětlení"),
+        (213, "Ložnice"),
+        (214, "Matrace"),
+        (215, "Obývací stěny"),
+        (216, "Postele"),
+        (217, "Sedací soupravy"),
+        (218, "Skříně"),
+        (219, "Stoly"),
+        (220, "Zahradní nábytek"),
+        (221, "Židle"),
+        (429, "Doplňky"),
+        (222, "Ostatní nábytek"),
+    ],
+    "ob": [
+        (419, "Batohy, Kufry"),
+        (420, "Boty"),
+        (426, "Bundy a Kabáty"),
+        (399, "Čepice a Šátky"),
+        (421, "Doplňky"),
+        (400, "Džíny"),
+        (401, "Halenky"),
+        (422, "Hodinky"),
+        (423, "Kabelky"),
+        (402, "Kalhoty"),
+        (403, "Košile"),
+        (404, "Kožené oděvy"),
+        (405, "Mikiny"),
+        (406, "Obleky a Saka"),
+        (407, "Plavky"),
+        (462, "Roušky"),
+        (408, "Rukavice a Šály"),
+        (414, "Šaty, Kostýmky"),
+        (415, "Šortky"),
+        (424, "Šperky"),
+        (409, "Spodní prádlo"),
+        (410, "Sportovní oblečení"),
+        (411, "Sukně"),
+        (412, "Svatební šaty"),
+        (416, "Těhotenské oblečení"),
+        (413, "Svetry"),
+        (417, "Termo prádlo"),
+        (418, "Trička, tílka"),
+        (425, "Ostatní"),
+    ],
+    "sl": [
+        (430, "Auto Moto"),
+        (223, "Cestování"),
+        (224, "Domácí práce"),
+        (431, "Esoterika"),
+        (227, "Hlídání dětí"),
+        (228, "IT, webdesign"),
+        (441, "Koně - služby"),
+        (229, "Kurzy a školení"),
+        (432, "Opravy, servis"),
+        (433, "Pořádání akcí"),
+        (434, "Právo a bezpečnost"),
+        (230, "Překladatelství"),
+        (231, "Přeprava a Stěhování"),
+        (435, "Půjčovny"),
+        (436, "Realitní služby"),
+        (239, "Reklama na auto"),
+        (240, "Reklamní plochy - ostatní"),
+        (232, "Řemeslné a stavební práce"),
+        (54, "Služby pro zvířata"),
+        (438, "Tvůrčí služby"),
+        (234, "Ubytování"),
+        (226, "Účetnictví, poradenství"),
+        (235, "Úklid"),
+        (437, "Výroba"),
+        (241, "Výuka hudby"),
+        (225, "Výuka, doučování"),
+        (238, "Zdraví a krása"),
+        (236, "Zprostředkovatelské služby"),
+        (237, "Ostatní"),
+    ],
+    "os": [
+        (458, "Mince, bankovky"),
+        (457, "Modelářství"),
+        (36, "Potraviny"),
+        (37, "Sběratelství"),
+        (38, "Sklo, keramika"),
+        (39, "Starožitnosti"),
+        (41, "Umělecké předměty"),
+        (42, "Zdraví a krása"),
+        (459, "Známky, pohledy"),
+        (43, "Ostatní"),
+    ],
+}
+
+
+def section_feed(output_dir, sec):
+    id = f"section_{sec}"
+    url = f"https://www.bazos.cz/rss.php?rub={sec}"
+    output_path = os.path.join(output_dir, f"{id}.csv")
+    return id, url, output_path, None
+
+
+def category_feeds(output_dir, sec, cats):
+    for cat, cat_name in cats:
+        id = f"section_{sec}_category_{cat}"
+        url = f"https://www.bazos.cz/rss.php?rub={sec}&cat={cat}"
+        output_path = os.path.join(output_dir, f"{id}.csv")
+        yield id, url, output_path, cat_name
+
+
+def requests_per_hour(rate):
+    # polls needed to catch every entry when each poll finds the feed half full
+    if rate <= 0:
+        return 3600 / max_interval
+    interval = min(max(feed_size / 2 / rate, min_interval), max_interval)
+    return 3600 / interval
+
+
+class FeedPlanner:
+    """
+    Decides which sections are polled as one section feed and which per category.
+
+    A section feed that keeps overflowing at the shortest interval is split into
+    its category feeds if the request budget allows it. A split section whose
+    categories together post so little that the section feed would stay well
+    under the feed size is merged back. Rates are EWMAs of the watcher stats
+    taken on every plan() call.
+    """
+
+    def __init__(
+        self,
+        output_dir,
+        sections,
+        split_sections,
+        make_watcher,
+        request_budget,
+        state_store=None,
+        split_overflow_ratio=0.05,
+        merge_fill=10,
+        min_dwell=24 * 60 * 60,
+        min_observed=6 * 60 * 60,
+        smoothing=0.1,
+    ):
+        self.output_dir = output_dir
+        self.sections = sections
+        self.make_watcher = make_watcher
+        # requests per hour
+        self.request_budget = request_budget
+        self.state_store = state_store
+        self.split_overflow_ratio = split_overflow_ratio
+        # expected entries per shortest interval under which a split section is merged
+        self.merge_fill = merge_fill
+        self.min_dwell = min_dwell
+        self.min_observed = min_observed
+        self.smoothing = smoothing
+        self.split_sections = set(split_sections)
+        self.changed = {}
+        self.feeds = {}
+        self.snapshots = {}
+        self.rates = {}
+        self.overflow_ratios = {}
+        self.logger = logging.getLogger(name="planner")
+
+        plan = state_store.load_meta("feed_plan") if state_store else None
+        if plan is not None:
+            self.split_sections = set(plan["split_sections"])
+            self.changed = plan["changed"]
+
+    def _feeds(self, sec, split):
+        if split:
+            settings = category_feeds(self.output_dir, sec, categories[sec])
+        else:
+            settings = [section_feed(self.output_dir, sec)]
+        return [self.make_watcher(*setting) for setting in settings]
+
+    def build(self):
+        watchers = []
+        for sec in self.sections:
+            self.feeds[sec] = self._feeds(sec, sec in self.split_sections)
+            watchers.extend(self.feeds[sec])
+        return watchers
+
+    def _observe(self, watcher):
+        stats = watcher.stats
+        previous = self.snapshots.get(watcher.id)
+        self.snapshots[watcher.id] = dict(stats)
+        if previous is None:
+            return
+        observed = stats["observed_seconds"] - previous["observed_seconds"]
+        polls = stats["polls"] - previous["polls"]
+        if observed <= 0 or polls <= 0:
+            return
+
+        rate = (stats["entries"] - previous["entries"]) / observed
+        overflow_ratio = (stats["overflows"] - previous["overflows"]) / polls
+        if watcher.id not in self.rates:
+            self.rates[watcher.id] = rate
+            self.overflow_ratios[watcher.id] = overflow_ratio
+        else:
+            a = self.smoothing
+            self.rates[watcher.id] = (1 - a) * self.rates[watcher.id] + a * rate
+            self.overflow_ratios[watcher.id] = (1 - a) * self.overflow_ratios[
+                watcher.id
+            ] + a * overflow_ratio
+
+    def _known(self, watcher):
+        return (
+            watcher.id in self.rates
+            and watcher.stats["observed_seconds"] >= self.min_observed
+        )
+
+    def _settled(self, sec, now):
+        return now - self.changed.get(sec, 0) >= self.min_dwell
+
+    def _split(self, sec, now):
+        (section_watcher,) = self.feeds[sec]
+        new_watchers = self._feeds(sec, True)
+        cutoff = None
+        if section_watcher.last_timedate is not None:
+            cutoff = calendar.timegm(section_watcher.last_timedate)
+        for watcher in new_watchers:
+            watcher.seed(cutoff, section_watcher.recent_keys)
+        self.feeds[sec] = new_watchers
+        self.split_sections.add(sec)
+        self.changed[sec] = now
+        return new_watchers, [section_watcher]
+
+    def _merge(self, sec, now):
+        category_watchers = self.feeds[sec]
+        (section_watcher,) = self._feeds(sec, False)
+        # the oldest category decides, the recent keys drop what was already written
+        cutoffs = [watcher.last_timedate for watcher in category_watchers]
+        cutoff = None
+        if None not in cutoffs:
+            cutoff = min(calendar.timegm(timedate) for timedate in cutoffs)
+        keys = [key for watcher in category_watchers for key in watcher.recent_keys]
+        section_watcher.seed(cutoff, keys)
+        self.feeds[sec] = [section_watcher]
+        self.split_sections.discard(sec)
+        self.changed[sec] = now
+        return [section_watcher], category_watchers
+
+    def plan(self, now):
+        for watchers in self.feeds.values():
+            for watcher in watchers:
+                self._observe(watcher)
+
+        total = sum(
+            3600 / watcher.interval
+            for watchers in self.feeds.values()
+            for watcher in watchers
+        )
+        added = []
+        removed = []
+
+        # merge the quiet split sections first, that frees budget for the splits
+        merges = []
+        for sec in self.split_sections:
+            watchers = self.feeds[sec]
+            if not self._settled(sec, now) or not all(map(self._known, watchers)):
+                continue
+            rate = sum(self.rates[watcher.id] for watcher in watchers)
+            cost = sum(3600 / watcher.interval for watcher in watchers)
+            fill = rate * min_interval
+            quiet = fill <= self.merge_fill
+            # over budget, merge anything that fits into one feed
+            squeeze = total > self.request_budget and fill < feed_size / 2
+            if (quiet or squeeze) and requests_per_hour(rate) < cost:
+                merges.append((fill, sec, requests_per_hour(rate) - cost))
+        for fill, sec, delta in sorted(merges):
+            if fill > self.merge_fill and total <= self.request_budget:
+                continue
+            self.logger.info(
+                f"Merging section {sec}, expecting {fill:.1f} entries per {min_interval} seconds"
+            )
+            new_watchers, old_watchers = self._merge(sec, now)
+            added.extend(new_watchers)
+            removed.extend(old_watchers)
+            total += delta
+
+        splits = []
+        for sec, watchers in self.feeds.items():
+            if sec in self.split_sections or sec not in categories:
+                continue
+            (watcher,) = watchers
+            if not self._settled(sec, now) or not self._known(watcher):
+                continue
+            overflow_ratio = self.overflow_ratios[watcher.id]
+            if (
+                overflow_ratio < self.split_overflow_ratio
+                or watcher.interval > min_interval
+            ):
+                continue
+            # an overflowing feed hides part of its rate, assume at least a full feed per poll
+            rate = max(self.rates[watcher.id], feed_size / min_interval)
+            num_categories = len(categories[sec])
+            cost = num_categories * requests_per_hour(rate / num_categories)
+            splits.append((-overflow_ratio, sec, cost - 3600 / watcher.interval))
+        for neg_ratio, sec, delta in sorted(splits):
+            if total + delta > self.request_budget:
+                self.logger.warning(
+                    f"Section {sec} overflows in {-neg_ratio:.0%} of polls, but splitting it would exceed the budget of {self.request_budget:.0f} requests per hour"
+                )
+                continue
+            self.logger.info(
+                f"Splitting section {sec}, it overflows in {-neg_ratio:.0%} of polls"
+            )
+            new_watchers, old_watchers = self._split(sec, now)
+            added.extend(new_watchers)
+            removed.extend(old_watchers)
+            total += delta
+
+        if (added or removed) and self.state_store is not None:
+            self.state_store.save_meta(
+                "feed_plan",
+                {"split_sections": sorted(self.split_sections), "changed": self.changed},
+            )
+        self.logger.info(
+            f"Planned {total:.0f} requests per hour, the budget is {self.request_budget:.0f}"
+        )
+        return added, removed
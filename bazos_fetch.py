@@ -0,0 +1,124 @@
+import gzip
+import http.client
+import logging
+import queue
+import threading
+from collections import namedtuple
+from urllib.parse import urljoin, urlsplit
+
+Response = namedtuple("Response", ["status", "headers", "body", "url"])
+
+
+class ConnectionPool:
+    def __init__(self, scheme, host, max_size=8, timeout=30):
+        self.scheme = scheme
+        self.host = host
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+
+    def get(self):
+        # returns the connection and whether it was reused from the pool
+        try:
+            return self.idle.get_nowait(), True
+        except queue.Empty:
+            pass
+        if self.scheme == "https":
+            conn = http.client.HTTPSConnection(self.host, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(self.host, timeout=self.timeout)
+        return conn, False
+
+    def put(self, conn):
+        if self.idle.qsize() < self.max_size:
+            self.idle.put(conn)
+        else:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class FeedFetcher:
+    def __init__(self, user_agent, max_connections=8, timeout=30, max_redirects=5):
+        self.user_agent = user_agent
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.pools = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(name="fetcher")
+
+    def pool(self, scheme, host):
+        with self.lock:
+            key = (scheme, host)
+            if key not in self.pools:
+                self.pools[key] = ConnectionPool(
+                    scheme, host, self.max_connections, self.timeout
+                )
+            return self.pools[key]
+
+    def _request(self, url, headers):
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        pool = self.pool(parts.scheme, parts.netloc)
+
+        while True:
+            conn, reused = pool.get()
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if reused:
+                    # the server closed an idle keep-alive connection, retry on a new one
+                    self.logger.debug(f"Stale connection to {parts.netloc}, reconnecting")
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                pool.put(conn)
+            return response, body
+
+    def fetch(self, url, etag=None, modified=None):
+        headers = {
+            "User-Agent": self.user_agent,
+            "Accept-Encoding": "gzip",
+            "Connection": "keep-alive",
+        }
+        if etag:
+            headers["If-None-Match"] = etag
+        if modified:
+            headers["If-Modified-Since"] = modified
+
+        for _ in range(self.max_redirects + 1):
+            response, body = self._request(url, headers)
+            if response.status in (301, 302, 303, 307, 308):
+                url = urljoin(url, response.getheader("Location"))
+                continue
+
+            response_headers = {
+                key.lower(): value for key, value in response.getheaders()
+            }
+            if response_headers.get("content-encoding") == "gzip":
+                body = gzip.decompress(body)
+            return Response(response.status, response_headers, body, url)
+
+        raise http.client.HTTPException(f"Too many redirects for {url}")
+
+    def close(self):
+        with self.lock:
+            for pool in self.pools.values():
+                pool.close()
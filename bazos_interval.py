@@ -0,0 +1,270 @@
+from argparse import ArgumentParser
+from email.utils import mktime_tz, parsedate_tz
+import bisect
+import csv
+import logging
+import math
+
+feed_size = 30
+min_interval = 600
+max_interval = 24 * 60 * 60
+hours_per_week = 7 * 24
+
+
+class LegacyIntervalEstimator:
+    """
+    The original hand-tuned rule: poll about every 15 entries, judged by the spread
+    of the entries in the latest feed, smoothed by half when the interval grows.
+    """
+
+    name = "legacy"
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger(name="interval")
+        self.timestamps = []
+        self.now = None
+
+    def observe(self, timestamps, num_new, since, now):
+        self.timestamps = timestamps
+        self.now = now
+
+    def next_interval(self, interval, now):
+        timestamps = self.timestamps
+        max_timedate = timestamps[-1]
+        min_timedate = timestamps[0]
+        middle_timedate = timestamps[int(len(timestamps) / 2)]
+
+        if len(timestamps) == 1:
+            self.logger.info(
+                f"Got only one entry in response, computing seconds_between_entries with respect to current time"
+            )
+            seconds_between_entries = now - min_timedate
+            seconds_between_newest_and_middle = seconds_between_entries / 2
+        else:
+            seconds_between_entries = max_timedate - min_timedate
+            seconds_between_newest_and_middle = max_timedate - middle_timedate
+
+        self.logger.info(
+            f"Time between first and last entry is {seconds_between_entries} seconds, half {seconds_between_entries/2}. Time between first and middle entry is {seconds_between_newest_and_middle}"
+        )
+
+        seconds_between_15_entries = min(
+            seconds_between_newest_and_middle, seconds_between_entries / 2
+        )
+
+        if seconds_between_15_entries > interval:
+            # smoothing when we increase the interval
+            new_interval = interval + 0.5 * (seconds_between_15_entries - interval)
+        else:
+            # no smoothing when we decrease
+            new_interval = seconds_between_15_entries
+
+        return int(max(new_interval, min_interval))
+
+    def to_state(self):
+        return {}
+
+    def load_state(self, state):
+        pass
+
+
+class PoissonIntervalEstimator:
+    """
+    Models the posting rate of a feed per hour of the week (UTC) as a Poisson process.
+
+    The rate of every hour bucket is an exponentially weighted count of arrivals
+    divided by the observed time, shrunk towards the overall rate of the feed.
+    The next interval is the longest one for which the probability that a full
+    feed (30 entries) arrives before the next poll stays under overflow_target.
+    """
+
+    name = "poisson"
+
+    def __init__(
+        self,
+        logger=None,
+        overflow_target=0.01,
+        memory=4 * 60 * 60,
+        prior_strength=30 * 60,
+        safety=1.0,
+    ):
+        self.logger = logger or logging.getLogger(name="interval")
+        self.overflow_target = overflow_target
+        # seconds of observation of one hour bucket after which old data weighs 1/e
+        self.memory = memory
+        self.prior_strength = prior_strength
+        self.safety = safety
+        self.counts = [0.0] * hours_per_week
+        self.exposure = [0.0] * hours_per_week
+
+    def _bucket(self, timestamp):
+        # 1.1.1970 was a Thursday, shift so that the week starts on Monday
+        return int((timestamp // 3600 + 3 * 24) % hours_per_week)
+
+    def _segments(self, start, end):
+        # splits [start, end) on hour boundaries into (bucket, seconds) pairs
+        while start < end:
+            boundary = min((start // 3600 + 1) * 3600, end)
+            yield self._bucket(start), boundary - start
+            start = boundary
+
+    def observe(self, timestamps, num_new, since, now):
+        if since is None or (num_new >= feed_size and timestamps[0] > since):
+            # no previous poll or the feed overflowed, the feed itself is the window
+            start = timestamps[0]
+            arrivals = timestamps[1:]
+        else:
+            start = since
+            arrivals = timestamps[len(timestamps) - num_new :]
+
+        for bucket, seconds in self._segments(start, now):
+            decay = math.exp(-seconds / self.memory)
+            self.counts[bucket] *= decay
+            self.exposure[bucket] = self.exposure[bucket] * decay + seconds
+        for timestamp in arrivals:
+            self.counts[self._bucket(timestamp)] += 1
+
+    def rate(self, bucket):
+        # returns the estimated rate and its variance
+        total_exposure = sum(self.exposure)
+        if total_exposure == 0:
+            overall = 1 / min_interval
+        else:
+            overall = sum(self.counts) / total_exposure
+        exposure = self.exposure[bucket] + self.prior_strength
+        rate = (self.counts[bucket] + self.prior_strength * overall) / exposure
+        return rate, rate / exposure
+
+    def overflow_probability(self, interval, now):
+        expected = 0
+        variance = 0
+        for bucket, seconds in self._segments(now, now + interval):
+            rate, rate_variance = self.rate(bucket)
+            expected += rate * seconds
+            variance += rate_variance * seconds**2
+        # plan for the rate being one standard error above the estimate
+        expected += self.safety * math.sqrt(variance)
+        # P(N >= feed_size) for N ~ Poisson(expected)
+        term = math.exp(-expected)
+        below = 0
+        for i in range(feed_size):
+            below += term
+            term *= expected / (i + 1)
+        return max(1 - below, 0)
+
+    def next_interval(self, interval, now):
+        low, high = min_interval, max_interval
+        if self.overflow_probability(high, now) <= self.overflow_target:
+            return high
+        # the probability grows with the interval, bisect to a minute
+        while high - low > 60:
+            middle = (low + high) // 2
+            if self.overflow_probability(middle, now) <= self.overflow_target:
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def to_state(self):
+        return {"counts": self.counts, "exposure": self.exposure}
+
+    def load_state(self, state):
+        self.counts = state["counts"]
+        self.exposure = state["exposure"]
+
+
+estimators = {
+    LegacyIntervalEstimator.name: LegacyIntervalEstimator,
+    PoissonIntervalEstimator.name: PoissonIntervalEstimator,
+}
+
+
+def make_estimator(name, logger=None, **options):
+    return estimators[name](logger, **options)
+
+
+def replay(estimator, arrivals, start=None):
+    """
+    Simulates polling a feed with the given sorted arrival timestamps.
+
+    Returns the number of requests, overflowed polls and entries that fell out
+    of the 30 entry window before they could be seen.
+    """
+    if start is None:
+        start = arrivals[0]
+    end = arrivals[-1]
+    now = start
+    since = None
+    interval = min_interval
+    stats = {"requests": 0, "overflows": 0, "missed": 0, "entries": len(arrivals)}
+    while now <= end:
+        seen = bisect.bisect_right(arrivals, now)
+        timestamps = arrivals[max(seen - feed_size, 0) : seen]
+        if since is None:
+            num_new = len(timestamps)
+        else:
+            num_new = seen - bisect.bisect_right(arrivals, since)
+        stats["requests"] += 1
+
+        if timestamps:
+            if since is not None and num_new >= feed_size:
+                stats["overflows"] += 1
+                stats["missed"] += num_new - feed_size
+            estimator.observe(timestamps, min(num_new, feed_size), since, now)
+            interval = estimator.next_interval(interval, now)
+        else:
+            interval = min(interval * 2, max_interval)
+        since = now
+        now += interval
+    return stats
+
+
+def read_arrivals(csv_files):
+    arrivals = []
+    for csv_file in csv_files:
+        with open(csv_file, newline="") as f:
+            for row in csv.reader(f):
+                if len(row) != 5:
+                    continue
+                parsed = parsedate_tz(row[3])
+                if parsed is not None:
+                    arrivals.append(mktime_tz(parsed))
+    arrivals.sort()
+    return arrivals
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser(
+        description="Compare the interval estimators by replaying scraped feeds"
+    )
+    ap.add_argument("csv_files", type=str, nargs="+", help="Scraped CSVs of one feed")
+    ap.add_argument(
+        "--estimator",
+        type=str,
+        nargs="+",
+        default=list(estimators),
+        choices=list(estimators),
+        help="Estimators to compare",
+    )
+    ap.add_argument(
+        "--overflow-target",
+        type=float,
+        default=0.01,
+        help="Allowed probability of overflowing the feed for the poisson estimator",
+    )
+    args = ap.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    arrivals = read_arrivals(args.csv_files)
+    days = (arrivals[-1] - arrivals[0]) / (24 * 60 * 60)
+    print(f"Replaying {len(arrivals)} entries over {days:.1f} days")
+    for name in args.estimator:
+        options = {}
+        if name == PoissonIntervalEstimator.name:
+            options["overflow_target"] = args.overflow_target
+        stats = replay(make_estimator(name, **options), arrivals)
+        print(
+            f"{name}: {stats['requests'] / days:.1f} requests per day, "
+            f"{stats['overflows']} overflows ({stats['overflows'] / stats['requests']:.2%} of polls), "
+            f"{stats['missed']} missed entries ({stats['missed'] / stats['entries']:.2%})"
+        )
@@ -0,0 +1,177 @@
+import asyncio
+import math
+import sqlite3
+import time
+from urllib.parse import urlparse
+
+
+def connect(path):
+    # autocommit mode, the transactions are started explicitly with BEGIN IMMEDIATE
+    # the connections are used from the worker threads of asyncio.to_thread
+    conn = sqlite3.connect(
+        path, timeout=60, isolation_level=None, check_same_thread=False
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+class LeaseTable:
+    """
+    Splits the watchers between scraper workers sharing one SQLite database.
+
+    Every worker heartbeats and renews its leases on each sync() and claims free or
+    expired leases up to its fair share. When a worker dies its leases expire after
+    ttl seconds and the other workers take its watchers over.
+    """
+
+    def __init__(self, path, worker_id, ttl=120):
+        self.path = path
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.conn = connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS workers ("
+            "worker_id TEXT PRIMARY KEY, heartbeat REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            "watcher_id TEXT PRIMARY KEY, worker_id TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+
+    def sync(self, watcher_ids, now=None):
+        if now is None:
+            now = time.time()
+        expires = now + self.ttl
+        wanted = set(watcher_ids)
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO workers (worker_id, heartbeat) VALUES (?, ?)",
+                (self.worker_id, now),
+            )
+            conn.execute(
+                "DELETE FROM workers WHERE heartbeat < ?", (now - self.ttl,)
+            )
+            conn.execute(
+                "UPDATE leases SET expires = ? WHERE worker_id = ?",
+                (expires, self.worker_id),
+            )
+            num_workers = conn.execute("SELECT COUNT(*) FROM workers").fetchone()[0]
+            share = math.ceil(len(watcher_ids) / num_workers)
+
+            held = [
+                row[0]
+                for row in conn.execute(
+                    "SELECT watcher_id FROM leases WHERE worker_id = ? ORDER BY watcher_id",
+                    (self.worker_id,),
+                )
+            ]
+            held = [id for id in held if id in wanted]
+            if len(held) > share:
+                # a worker joined, give the surplus back
+                conn.executemany(
+                    "DELETE FROM leases WHERE watcher_id = ?",
+                    [(id,) for id in held[share:]],
+                )
+                held = held[:share]
+            elif len(held) < share:
+                taken = {
+                    row[0]
+                    for row in conn.execute(
+                        "SELECT watcher_id FROM leases WHERE expires >= ?", (now,)
+                    )
+                }
+                free = [id for id in watcher_ids if id not in taken]
+                claimed = free[: share - len(held)]
+                conn.executemany(
+                    "INSERT OR REPLACE INTO leases (watcher_id, worker_id, expires) VALUES (?, ?, ?)",
+                    [(id, self.worker_id, expires) for id in claimed],
+                )
+                held.extend(claimed)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return set(held)
+
+    def release(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.execute("DELETE FROM leases WHERE worker_id = ?", (self.worker_id,))
+        self.conn.execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,))
+        self.conn.execute("COMMIT")
+
+
+class SharedTokenBucket:
+    """
+    Token bucket kept in SQLite, so that the rate limit holds across processes.
+    """
+
+    def __init__(self, path, key, rate, capacity=1):
+        self.path = path
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+        self.conn = None
+
+    def _take(self):
+        # returns 0 when a token was taken, otherwise seconds to wait for one
+        if self.conn is None:
+            self.conn = connect(self.path)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+        conn = self.conn
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated FROM buckets WHERE key = ?", (self.key,)
+            ).fetchone()
+            if row is None:
+                tokens = self.capacity
+            else:
+                tokens = min(
+                    self.capacity, row[0] + max(now - row[1], 0) * self.rate
+                )
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (self.key, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    async def acquire(self):
+        while True:
+            wait = await asyncio.to_thread(self._take)
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+
+class SharedHostRateLimiter:
+    def __init__(self, path, rate, capacity=1):
+        self.path = path
+        self.rate = rate
+        self.capacity = capacity
+        self.buckets = {}
+
+    def bucket(self, url):
+        host = urlparse(url).hostname
+        if host not in self.buckets:
+            self.buckets[host] = SharedTokenBucket(
+                self.path, host, self.rate, self.capacity
+            )
+        return self.buckets[host]
+
+    async def acquire(self, url):
+        await self.bucket(url).acquire()
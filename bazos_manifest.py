@@ -0,0 +1,183 @@
+from glob import glob
+import hashlib
+import json
+import os
+import re
+
+import numpy
+import pandas
+
+section_pattern = re.compile(r"section_([a-z]+)(_part\d+)?\.csv$")
+manifest_name = "manifest.json"
+quantiles = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+# log spaced price bins, 100 per decade, bin 0 holds prices under 1
+bins_per_decade = 100
+
+
+def price_bin(prices):
+    prices = numpy.maximum(prices, 0)
+    return numpy.where(
+        prices < 1, 0, numpy.floor(numpy.log10(numpy.maximum(prices, 1)) * bins_per_decade) + 1
+    ).astype("int64")
+
+
+def bin_price(bin):
+    # geometric middle of the bin
+    if bin == 0:
+        return 0
+    return 10 ** ((bin - 0.5) / bins_per_decade)
+
+
+def histogram_quantiles(histogram):
+    total = sum(histogram.values())
+    result = {}
+    if total == 0:
+        return result
+    bins = sorted(histogram)
+    counts = numpy.cumsum([histogram[b] for b in bins])
+    for q in quantiles:
+        i = int(numpy.searchsorted(counts, q * total))
+        result[str(q)] = round(bin_price(bins[min(i, len(bins) - 1)]), 2)
+    return result
+
+
+class PartitionStats:
+    """
+    Statistics of one written CSV, updated chunk by chunk.
+
+    The price quantiles come from a histogram with 100 log spaced bins per decade,
+    so they are within about 1.2 % and the histograms of the partitions of a
+    section can be merged.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.price_nulls = 0
+        self.histogram = {}
+        self.months = {}
+
+    def update(self, df, datetime=None):
+        self.rows += len(df)
+        prices = pandas.to_numeric(df["price"], errors="coerce")
+        self.price_nulls += int(prices.isna().sum())
+        bins, counts = numpy.unique(price_bin(prices.dropna().to_numpy()), return_counts=True)
+        for b, c in zip(bins.tolist(), counts.tolist()):
+            self.histogram[b] = self.histogram.get(b, 0) + c
+
+        if datetime is None:
+            datetime = pandas.to_datetime(df["datetime"], utc=True)
+        for month, group in datetime.groupby(datetime.dt.strftime("%Y-%m")):
+            low, high = group.min().isoformat(), group.max().isoformat()
+            stats = self.months.setdefault(
+                month, {"rows": 0, "min_datetime": low, "max_datetime": high}
+            )
+            stats["rows"] += len(group)
+            stats["min_datetime"] = min(stats["min_datetime"], low)
+            stats["max_datetime"] = max(stats["max_datetime"], high)
+
+    def to_dict(self):
+        months = self.months
+        return {
+            "rows": self.rows,
+            "min_datetime": min((m["min_datetime"] for m in months.values()), default=None),
+            "max_datetime": max((m["max_datetime"] for m in months.values()), default=None),
+            "price_nulls": self.price_nulls,
+            "price_quantiles": histogram_quantiles(self.histogram),
+            "price_histogram": {str(b): c for b, c in sorted(self.histogram.items())},
+            "months": dict(sorted(months.items())),
+        }
+
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def sidecar_path(csv_path):
+    return csv_path + ".manifest.json"
+
+
+def write_sidecar(csv_path, stats, gz_path=None):
+    entry = stats.to_dict()
+    entry["file"] = os.path.basename(csv_path)
+    entry["bytes"] = os.path.getsize(csv_path)
+    entry["sha256"] = file_digest(csv_path)
+    if gz_path is not None:
+        entry["gz_file"] = os.path.basename(gz_path)
+        entry["gz_bytes"] = os.path.getsize(gz_path)
+        entry["gz_sha256"] = file_digest(gz_path)
+    with open(sidecar_path(csv_path), "w") as f:
+        json.dump(entry, f, indent=1)
+    return entry
+
+
+def build_manifest(directory="anon_output_merged"):
+    """
+    Merges the sidecars of all partitions in directory into directory/manifest.json.
+
+    The UTC datetimes are ISO strings, so they compare correctly as strings.
+    """
+    sections = {}
+    for path in sorted(glob(os.path.join(directory, "section_*.csv.manifest.json"))):
+        with open(path) as f:
+            entry = json.load(f)
+        section = section_pattern.search(entry["file"]).group(1)
+        sections.setdefault(section, []).append(entry)
+
+    manifest = {"sections": {}}
+    for section, partitions in sorted(sections.items()):
+        histogram = {}
+        for p in partitions:
+            for b, c in p["price_histogram"].items():
+                histogram[int(b)] = histogram.get(int(b), 0) + c
+        lows = [p["min_datetime"] for p in partitions if p["min_datetime"] is not None]
+        highs = [p["max_datetime"] for p in partitions if p["max_datetime"] is not None]
+        manifest["sections"][section] = {
+            "rows": sum(p["rows"] for p in partitions),
+            "min_datetime": min(lows, default=None),
+            "max_datetime": max(highs, default=None),
+            "price_nulls": sum(p["price_nulls"] for p in partitions),
+            "price_quantiles": histogram_quantiles(histogram),
+            "bytes": sum(p["bytes"] for p in partitions),
+            "gz_bytes": sum(p.get("gz_bytes", 0) for p in partitions),
+            "partitions": {
+                p["file"]: {k: v for k, v in p.items() if k != "price_histogram"}
+                for p in partitions
+            },
+        }
+
+    path = os.path.join(directory, manifest_name)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".tmp", path)
+    return manifest
+
+
+def load_manifest(directory="anon_output_merged"):
+    with open(os.path.join(directory, manifest_name)) as f:
+        return json.load(f)
+
+
+def prune_partitions(manifest, section, start=None, end=None):
+    # files of the section with data in [start, end), the bounds are UTC ISO strings
+    files = []
+    for file, partition in manifest["sections"][section]["partitions"].items():
+        if partition["rows"] == 0:
+            continue
+        if start is not None and partition["max_datetime"] < start:
+            continue
+        if end is not None and partition["min_datetime"] >= end:
+            continue
+        files.append(file)
+    return files
+
+
+if __name__ == "__main__":
+    manifest = build_manifest()
+    for section, stats in manifest["sections"].items():
+        print(f"{section}: {stats['rows']} rows, {stats['min_datetime']} - {stats['max_datetime']}")
+    total = sum(stats["rows"] for stats in manifest["sections"].values())
+    print(f"Total: {total} rows")
@@ -0,0 +1,200 @@
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import time
+
+from bazos_anonymize import anonymize_file
+from bazos_manifest import build_manifest
+from bazos_postprocess import section_inputs, sections, write_increment, write_section
+
+
+def limit_memory(max_memory):
+    # a worker over the limit fails with MemoryError instead of swapping the whole machine
+    if max_memory is None:
+        return
+    import resource
+
+    resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+
+
+def run_section(
+    section,
+    batch_size=100000,
+    closed_only=False,
+    dedup=False,
+    incremental=False,
+    parquet=False,
+    compress=False,
+):
+    timing = {"section": section}
+
+    start = time.monotonic()
+    csv_files = section_inputs(section, closed_only)
+    if incremental:
+        merged_path, timing["rows"] = write_increment(
+            section, csv_files, "output_merged", batch_size, dedup
+        )
+    else:
+        merged_path = f"output_merged/section_{section}.csv"
+        timing["rows"] = write_section(csv_files, merged_path, batch_size, dedup)
+    timing["postprocess"] = time.monotonic() - start
+
+    start = time.monotonic()
+    timing["anonymized_rows"] = 0
+    if merged_path is not None:
+        # the sections run in parallel already, two threads keep the compression off the critical path
+        timing["anonymized_rows"] = anonymize_file(
+            merged_path, "anon_" + merged_path, compress=compress, threads=2
+        )
+    timing["anonymize"] = time.monotonic() - start
+
+    start = time.monotonic()
+    if parquet and merged_path is not None:
+        # pyarrow is only needed for the Parquet output
+        from bazos_dataset import write_parquet
+
+        write_parquet("anon_" + merged_path, section, append=incremental)
+    timing["parquet"] = time.monotonic() - start
+    return timing
+
+
+def run_pipeline(
+    sections=sections,
+    workers=None,
+    max_memory=None,
+    batch_size=100000,
+    closed_only=False,
+    dedup=False,
+    incremental=False,
+    parquet=False,
+    compress=False,
+):
+    """
+    Postprocesses and anonymizes the sections in a process pool.
+
+    The sections with the most input data start first, so that the big ones
+    (au, de, os) do not end up running alone at the end.
+    """
+    os.makedirs("output_merged", exist_ok=True)
+    os.makedirs("anon_output_merged", exist_ok=True)
+
+    sizes = {
+        section: sum(os.path.getsize(f) for f in section_inputs(section, closed_only))
+        for section in sections
+    }
+    order = sorted(sections, key=lambda section: sizes[section], reverse=True)
+
+    timings = []
+    failed = []
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=limit_memory, initargs=(max_memory,)
+    ) as executor:
+        futures = {
+            executor.submit(
+                run_section,
+                section,
+                batch_size,
+                closed_only,
+                dedup,
+                incremental,
+                parquet,
+                compress,
+            ): section
+            for section in order
+        }
+        for future in as_completed(futures):
+            section = futures[future]
+            try:
+                timings.append(future.result())
+            except Exception as e:
+                print(f"Section {section} failed: {e!r}")
+                failed.append(section)
+
+    build_manifest("anon_output_merged")
+    return timings, failed, sizes
+
+
+def print_summary(timings, sizes, elapsed):
+    steps = ["postprocess", "anonymize", "parquet"]
+    print(f"{'section':>8} {'input MB':>10} {'rows':>10} {'anon rows':>10} {'post s':>8} {'anon s':>8} {'pq s':>8}")
+    for t in sorted(timings, key=lambda t: sum(t[s] for s in steps), reverse=True):
+        print(
+            f"{t['section']:>8} {sizes[t['section']] / 2**20:>10.1f} {t['rows']:>10} "
+            f"{t['anonymized_rows']:>10} {t['postprocess']:>8.1f} {t['anonymize']:>8.1f} {t['parquet']:>8.1f}"
+        )
+    busy = sum(t[s] for t in timings for s in steps)
+    print(f"Total: {sum(t['anonymized_rows'] for t in timings)} rows in {elapsed:.1f} s, {busy:.1f} s of worker time")
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser(
+        description="Postprocess and anonymize all sections in parallel"
+    )
+    ap.add_argument(
+        "--sections", type=str, nargs="+", default=sections, choices=sections
+    )
+    ap.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes",
+    )
+    ap.add_argument(
+        "--max-memory-gb",
+        type=float,
+        default=None,
+        help="Address space limit of every worker process",
+    )
+    ap.add_argument(
+        "--batch-size",
+        type=int,
+        default=100000,
+        help="Number of rows parsed and written at once",
+    )
+    ap.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Drop repeated ads (same ad id in the link) found in several scraped files",
+    )
+    ap.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only process the data appended since the previous incremental run, as new partitions",
+    )
+    ap.add_argument(
+        "--parquet",
+        action="store_true",
+        help="Also write the anonymized sections to the Parquet dataset",
+    )
+    ap.add_argument(
+        "--compress",
+        action="store_true",
+        help="Also write the anonymized sections as block gzip files with an index",
+    )
+    ap.add_argument(
+        "--closed-only",
+        action="store_true",
+        help="Skip the monthly segments the scraper is still writing to",
+    )
+    args = ap.parse_args()
+
+    max_memory = None
+    if args.max_memory_gb is not None:
+        max_memory = int(args.max_memory_gb * 2**30)
+
+    start = time.monotonic()
+    timings, failed, sizes = run_pipeline(
+        args.sections,
+        args.workers,
+        max_memory,
+        args.batch_size,
+        args.closed_only,
+        args.dedup,
+        args.incremental,
+        args.parquet,
+        args.compress,
+    )
+    print_summary(timings, sizes, time.monotonic() - start)
+    if failed:
+        print(f"Failed sections: {' '.join(failed)}")
+        raise SystemExit(1)
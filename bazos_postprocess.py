@@ -1,76 +1,460 @@
+from argparse import ArgumentParser
 from glob import glob
 import os
+import sys
 import csv
+import heapq
+import json
+import numpy
 import pandas
+import re
 from datetime import datetime
 
-def parse_csvs(csv_files):
-    all_lines = []
-    for csv_file in csv_files:
+from bazos_dedup import AdIdSet, Deduplicator
+from bazos_writer import closed_segments, segment_pattern
+
+columns = ["title", "price", "price_string", "link", "datetime"]
+months = {
+    "Jan": "01",
+    "Feb": "02",
+    "Mar": "03",
+    "Apr": "04",
+    "May": "05",
+    "Jun": "06",
+    "Jul": "07",
+    "Aug": "08",
+    "Sep": "09",
+    "Oct": "10",
+    "Nov": "11",
+    "Dec": "12",
+}
+date_pattern = (
+    r"^(?:Mon|Tue|Wed|Thu|Fri|Sat|Sun), ([0-9]{2}) ("
+    + "|".join(months)
+    + r") ([0-9]{4}) ([0-9]{2}:[0-9]{2}:[0-9]{2}) ([+-])([0-9]{2})([0-9]{2})$"
+)
+
+
+def split_title_price_row(title):
+    # extract the price at the end of the title
+    # the price separator changed from - to : at some point
+    title_reversed = title[::-1]
+    dash = title_reversed.find("-")
+    colon = title_reversed.find(":")
+    split_on = "-"
+    if dash != -1 and colon != -1:
+        if dash < colon:
+            split_on = "-"
+        else:
+            split_on = ":"
+    else:
+        if dash != -1:
+            split_on = "-"
+        elif colon != -1:
+            split_on = ":"
+        else:
+            pass
+    title_split = title.rsplit(split_on, 1)
+    if len(title_split) != 2:
+        # no separator, this used to reuse the price of the previous row
+        return title.strip(), ""
+    title, price = title_split
+    return title.strip(), price.strip()
+
+
+def parse_price_row(price):
+    try:
+        return int(price.replace(" ", ""))
+    except ValueError:
+        return None
+
+
+def parse_date_row(date):
+    return datetime.strptime(date, "%a, %d %b %Y %H:%M:%S %z")
+
+
+def split_title_price(titles):
+    # the greedy group ends at the last - or :, the same split as split_title_price_row
+    parts = titles.str.extract(r"^(.*)[-:](.*)$", flags=re.DOTALL)
+    no_separator = parts[0].isna()
+    title = parts[0].where(~no_separator, titles).str.strip()
+    price = parts[1].where(~no_separator, "").str.strip()
+    return title, price, no_separator
+
+
+def parse_prices(prices):
+    compact = prices.str.replace(" ", "", regex=False)
+    simple = compact.str.fullmatch(r"[+-]?[0-9]+")
+    result = pandas.Series(numpy.nan, index=prices.index, dtype="float64")
+    result[simple] = compact[simple].astype("float64")
+    # int() also accepts unicode digits, underscores and surrounding whitespace
+    other = ~simple & compact.str.contains(r"\d")
+    for i in other[other].index:
+        value = parse_price_row(prices[i])
+        if value is not None:
+            result[i] = value
+    return result
+
+
+def parse_dates(dates):
+    """
+    Parses RFC 822 dates as produced by the Bazos RSS feed.
+
+    Returns the dates formatted like str() of the parsed datetime, which is how
+    they are written to the CSV, and the same instants as a UTC datetime64 column.
+    Dates in an unexpected format go through datetime.strptime.
+    """
+    # one string dtype, an all-NaN column would be float and break the concatenation
+    parts = dates.str.extract(date_pattern).astype(object).fillna("")
+    matched = (parts[0] != "").to_numpy()
+    day, month, year, clock, sign, hours, minutes = (parts[i] for i in range(7))
+    month = month.map(months).fillna("")
+    local = year + "-" + month + "-" + day + " " + clock
+    # str(datetime) writes a zero offset as +00:00
+    sign = sign.where((hours != "00") | (minutes != "00"), "+")
+    formatted = (local + sign + hours + ":" + minutes).copy()
+
+    offset = pandas.to_timedelta(
+        pandas.to_numeric(hours, errors="coerce") * 60 + pandas.to_numeric(minutes, errors="coerce"),
+        unit="m",
+    )
+    offset = offset.where(sign != "-", -offset)
+    utc = (
+        pandas.to_datetime(local.where(matched, None), format="%Y-%m-%d %H:%M:%S") - offset
+    ).dt.tz_localize("UTC").copy()
+
+    # dates in another format, the rows are set by position on the owned copies
+    fallback = numpy.flatnonzero(~matched)
+    if len(fallback):
+        parsed = [parse_date_row(dates.iloc[i]) for i in fallback]
+        formatted = formatted.astype(object)
+        formatted.iloc[fallback] = [str(date) for date in parsed]
+        utc.iloc[fallback] = [pandas.Timestamp(date).tz_convert("UTC") for date in parsed]
+    return formatted, utc
+
+
+def epoch_seconds(utc):
+    return ((utc - pandas.Timestamp(0, tz="UTC")) // pandas.Timedelta(seconds=1)).to_numpy(
+        dtype="int64"
+    )
+
+
+def make_batch(raw, start, formatted=None):
+    titles = pandas.Series(raw["title"], dtype="object")
+    title, price, no_separator = split_title_price(titles)
+    if no_separator.any():
+        print(f"{no_separator.sum()} titles without a price separator")
+    if formatted is None:
+        formatted, _ = parse_dates(pandas.Series(raw["date"], dtype="object"))
+
+    df = pandas.DataFrame(
+        {
+            "title": title,
+            # the price column is float like in the whole-section DataFrame, which always has missing prices
+            "price": parse_prices(price),
+            "price_string": price,
+            "link": pandas.Series(raw["link"], dtype="object"),
+            "datetime": formatted,
+        },
+        columns=columns,
+    )
+    df.index = pandas.RangeIndex(start, start + len(df))
+    return df
+
+
+def iter_records(csv_file, start, progress):
+    """
+    Yields the lines of the complete CSV records after the byte offset start.
+
+    A record is complete when it ends with a newline and has an even number of
+    quotes, a quoted title can contain newlines. The record the scraper is still
+    writing is left for the next run. progress[csv_file] is the byte offset
+    after the last yielded record.
+    """
+    with open(csv_file, "rb") as f:
+        f.seek(start)
+        offset = start
+        record = []
+        quotes = 0
+        for line in f:
+            record.append(line)
+            quotes += line.count(b'"')
+            if quotes % 2 == 0 and line.endswith(b"\n"):
+                for line in record:
+                    offset += len(line)
+                    yield line.decode()
+                progress[csv_file] = offset
+                record = []
+                quotes = 0
+
+
+def iter_rows(csv_file, offsets=None, progress=None):
+    if offsets is None:
         with open(csv_file, newline='') as csvfile:
-            reader = csv.reader(csvfile)
-            for row in reader:
-                if len(row) != 5:
-                    print(f"Not enough values in file {csv_file} row {row}")
-                    continue
-                
-                title, description, link, date, category = row
-                # extract the price at the end of the title
-                # the price separator changed from - to : at some point
-                try:
-                    title_reversed = title[::-1]
-                    dash = title_reversed.find("-")
-                    colon = title_reversed.find(":")
-                    split_on = "-"
-                    if dash != -1 and colon != -1:
-                        if dash < colon:
-                            split_on = "-"
-                        else:
-                            split_on = ":"
-                    else:
-                        if dash != -1:
-                            split_on = "-"
-                        elif colon != -1:
-                            split_on = ":"
-                        else:
-                            pass
-                    title_split = title.rsplit(split_on, 1)
-                    title, price = title_split
-                except:
-                    print(f"Error in file {csv_file} row {row}")
-                title = title.strip()
-                price = price.strip()
-                
-                # remove image from the begining of description
-                # obr = description.find('/>')
-                # if obr:
-                #     description = description[obr+2:]
-
-                # parse the price
-                price_int = price.replace(" ", "")
-                try:
-                    price_int = int(price_int)
-                except ValueError:
-                    price_int = None
-                
-                # parse the date
-                date = datetime.strptime(date, "%a, %d %b %Y %H:%M:%S %z")
-
-                all_lines.append({
-                    "title": title,
-                    "price": price_int,
-                    "price_string": price,
-                    # "description": description,
-                    "link": link,
-                    "datetime": date,
-                    # "category": category
-                })
-
-    df = pandas.DataFrame(all_lines)
+            yield from csv.reader(csvfile)
+    else:
+        yield from csv.reader(iter_records(csv_file, offsets[csv_file], progress))
+
+
+def iter_raw_batches(csv_files, batch_size=100000, offsets=None, progress=None):
+    raw = {"title": [], "link": [], "date": [], "source": []}
+    for csv_file in csv_files:
+        for row in iter_rows(csv_file, offsets, progress):
+            if len(row) != 5:
+                print(f"Not enough values in file {csv_file} row {row}")
+                continue
+
+            title, description, link, date, category = row
+            raw["title"].append(title)
+            raw["link"].append(link)
+            raw["date"].append(date)
+            raw["source"].append(csv_file)
+
+            if len(raw["title"]) >= batch_size:
+                yield raw
+                raw = {"title": [], "link": [], "date": [], "source": []}
+
+    if raw["title"]:
+        yield raw
+
+
+def section_inputs(section, closed_only=False):
+    """
+    The scraped CSVs of a section in output, output2, ...
+
+    output_merged matches the same glob, but it holds the merged sections and
+    their incremental parts, which are outputs.
+    """
+    csv_files = [
+        path
+        for path in glob(f"output*/section_{section}*.csv")
+        if os.path.normpath(os.path.dirname(path)) != "output_merged"
+    ]
+    if closed_only:
+        csv_files = closed_segments(csv_files)
+    return csv_files
+
+
+def iter_dated_rows(csv_file, batch_size, offsets=None, progress=None):
+    # the rows of one file with their epoch, parsed a batch at a time
+    for raw in iter_raw_batches([csv_file], batch_size, offsets, progress):
+        _, utc = parse_dates(pandas.Series(raw["date"], dtype="object"))
+        yield from zip(epoch_seconds(utc), raw["title"], raw["link"], raw["date"], raw["source"])
+
+
+def iter_time_ordered(csv_files, batch_size=100000, offsets=None, progress=None):
+    """
+    iter_raw_batches() with the rows of all the files merged by date.
+
+    Every scraped file is appended in time order, but a legacy category file covers
+    the whole history, so the files are merged instead of concatenated. Each file
+    keeps a small batch in memory, ties go to the earlier file in csv_files.
+    """
+    file_batch_size = max(batch_size // max(len(csv_files), 1), 1000)
+    rows = heapq.merge(
+        *(iter_dated_rows(f, file_batch_size, offsets, progress) for f in csv_files),
+        key=lambda row: row[0],
+    )
+    raw = {"title": [], "link": [], "date": [], "source": []}
+    for _, title, link, date, source in rows:
+        raw["title"].append(title)
+        raw["link"].append(link)
+        raw["date"].append(date)
+        raw["source"].append(source)
+        if len(raw["title"]) >= batch_size:
+            yield raw
+            raw = {"title": [], "link": [], "date": [], "source": []}
+    if raw["title"]:
+        yield raw
+
+
+def chronological(csv_files):
+    # legacy files without a month first, then the months, only breaks the ties of the dedup
+    def key(path):
+        match = segment_pattern.search(path)
+        return (match.group(1) if match else "", path)
+
+    return sorted(csv_files, key=key)
+
+
+def iter_batches(
+    csv_files, batch_size=100000, deduplicator=None, offsets=None, progress=None, start=0
+):
+    # sorted by date, so that the compressed blocks cover short time ranges
+    for raw in iter_time_ordered(csv_files, batch_size, offsets, progress):
+        formatted = None
+        if deduplicator is not None:
+            formatted, utc = parse_dates(pandas.Series(raw["date"], dtype="object"))
+            keep = deduplicator.keep(raw["link"], raw["source"], epoch_seconds(utc))
+            raw = {
+                column: [value for value, k in zip(values, keep) if k]
+                for column, values in raw.items()
+            }
+            formatted = formatted[keep].reset_index(drop=True)
+        yield make_batch(raw, start, formatted)
+        start += len(raw["title"])
+
+
+def find_earliest(csv_files, batch_size=100000, deduplicator=None, offsets=None):
+    # the first pass of the dedup, reads the same rows as iter_batches will
+    for raw in iter_raw_batches(csv_files, batch_size, offsets, {}):
+        _, utc = parse_dates(pandas.Series(raw["date"], dtype="object"))
+        deduplicator.observe(raw["link"], epoch_seconds(utc))
+    deduplicator.finish()
+
+
+def check_parity(csv_files, batch_size=100000):
+    # compares the column parsers with the per-row reference on every row of the inputs,
+    # the edge cases are in tests/test_parsing.py
+    mismatches = 0
+    rows = 0
+    for raw in iter_raw_batches(csv_files, batch_size):
+        titles = pandas.Series(raw["title"], dtype="object")
+        title, price, _ = split_title_price(titles)
+        prices = parse_prices(price)
+        for i, row_title in enumerate(raw["title"]):
+            expected_title, expected_price = split_title_price_row(row_title)
+            expected_int = parse_price_row(expected_price)
+            got_int = None if numpy.isnan(prices[i]) else prices[i]
+            if (title[i], price[i], got_int) != (
+                expected_title,
+                expected_price,
+                expected_int,
+            ):
+                mismatches += 1
+                print(f"Title {row_title!r}: {(title[i], price[i], got_int)} != {(expected_title, expected_price, expected_int)}")
+
+        formatted, utc = parse_dates(pandas.Series(raw["date"], dtype="object"))
+        for i, date in enumerate(raw["date"]):
+            expected = parse_date_row(date)
+            if formatted[i] != str(expected) or utc[i] != pandas.Timestamp(expected):
+                mismatches += 1
+                print(f"Date {date!r}: {formatted[i]} {utc[i]} != {expected}")
+        rows += len(raw["title"])
+
+    print(f"Checked {rows} rows, {mismatches} mismatches")
+    return mismatches == 0
+
+
+def parse_csvs(csv_files):
+    batches = list(iter_batches(csv_files))
+    if batches:
+        df = pandas.concat(batches)
+    else:
+        df = pandas.DataFrame()
     print(f"Loaded {len(df)} rows")
     return df
 
 
+def write_section(csv_files, output_path, batch_size=100000, dedup=False):
+    # the batches are appended one by one, so the memory does not grow with the section
+    deduplicator = None
+    if dedup:
+        csv_files = chronological(csv_files)
+        deduplicator = Deduplicator()
+        find_earliest(csv_files, batch_size, deduplicator)
+    total = 0
+    with open(output_path, "w", newline="") as f:
+        for df in iter_batches(csv_files, batch_size, deduplicator):
+            df.to_csv(f, header=f.tell() == 0)
+            total += len(df)
+        if f.tell() == 0:
+            pandas.DataFrame().to_csv(f)
+    print(f"Loaded {total} rows")
+    if deduplicator is not None:
+        deduplicator.report()
+    return total
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return {"files": {}, "parts": 0, "rows": 0, "seen": None}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    # written next to the old one and renamed, a crash leaves one of them intact
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def resume_offsets(csv_files, checkpoint):
+    offsets = {}
+    inodes = {}
+    for csv_file in csv_files:
+        stat = os.stat(csv_file)
+        saved = checkpoint["files"].get(csv_file)
+        offsets[csv_file] = 0
+        if saved is not None:
+            if saved["inode"] == stat.st_ino and saved["offset"] <= stat.st_size:
+                offsets[csv_file] = saved["offset"]
+            else:
+                print(f"File {csv_file} was replaced, reading it from the start")
+        inodes[csv_file] = stat.st_ino
+    return offsets, inodes
+
+
+def write_increment(section, csv_files, output_dir="output_merged", batch_size=100000, dedup=False):
+    """
+    Appends the rows scraped since the previous run as a new partition of the section.
+
+    The byte offset and inode of every input file is kept in
+    section_{section}.checkpoint.json, only the data after the offset is parsed.
+    The first run writes the whole history as part 0. Returns the path of the new
+    partition, or None when there were no new rows, and the number of rows.
+    """
+    checkpoint_path = f"{output_dir}/section_{section}.checkpoint.json"
+    checkpoint = load_checkpoint(checkpoint_path)
+    offsets, inodes = resume_offsets(csv_files, checkpoint)
+    progress = dict(offsets)
+
+    deduplicator = None
+    if dedup:
+        seen = None
+        if checkpoint["seen"] is not None:
+            seen = AdIdSet.load(f"{output_dir}/{checkpoint['seen']}")
+        csv_files = chronological(csv_files)
+        deduplicator = Deduplicator(seen)
+        find_earliest(csv_files, batch_size, deduplicator, offsets)
+
+    part = checkpoint["parts"]
+    part_path = f"{output_dir}/section_{section}_part{part:05d}.csv"
+    total = 0
+    with open(part_path + ".tmp", "w", newline="") as f:
+        for df in iter_batches(
+            csv_files, batch_size, deduplicator, offsets, progress, checkpoint["rows"]
+        ):
+            df.to_csv(f, header=f.tell() == 0)
+            total += len(df)
+    if total > 0:
+        os.replace(part_path + ".tmp", part_path)
+        checkpoint["parts"] = part + 1
+        checkpoint["rows"] += total
+    else:
+        os.remove(part_path + ".tmp")
+        part_path = None
+    print(f"Loaded {total} new rows")
+
+    old_seen = checkpoint["seen"]
+    if deduplicator is not None:
+        deduplicator.report()
+        checkpoint["seen"] = f"section_{section}.seen{part:05d}.npy"
+        deduplicator.seen.save(f"{output_dir}/{checkpoint['seen']}")
+    # the checkpoint goes last, a crash before it redoes the whole increment
+    checkpoint["files"].update(
+        {
+            csv_file: {"inode": inodes[csv_file], "offset": progress[csv_file]}
+            for csv_file in csv_files
+        }
+    )
+    save_checkpoint(checkpoint_path, checkpoint)
+    if old_seen is not None and old_seen != checkpoint["seen"]:
+        os.remove(f"{output_dir}/{old_seen}")
+    return part_path, total
+
+
 sections = [
     "zv",
     "de",
@@ -94,14 +478,56 @@ sections = [
     "os",
 ]
 
-os.makedirs("output_merged", exist_ok=True)
+if __name__ == "__main__":
+    ap = ArgumentParser(description="Merge the scraped CSVs into one CSV per section")
+    ap.add_argument(
+        "--batch-size",
+        type=int,
+        default=100000,
+        help="Number of rows parsed and written at once",
+    )
+    ap.add_argument(
+        "--check-parity",
+        action="store_true",
+        help="Only compare the column parsers with the per-row parsers on all inputs",
+    )
+    ap.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Drop repeated ads (same ad id in the link) found in several scraped files",
+    )
+    ap.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only parse the data appended since the previous incremental run and write it as a new partition",
+    )
+    ap.add_argument(
+        "--closed-only",
+        action="store_true",
+        help="Skip the monthly segments the scraper is still writing to",
+    )
+    args = ap.parse_args()
+
+    if args.check_parity:
+        csv_files = [path for section in sections for path in section_inputs(section)]
+        if not check_parity(csv_files, args.batch_size):
+            sys.exit(1)
+        sys.exit(0)
+
+    os.makedirs("output_merged", exist_ok=True)
 
-total = 0
-for section in sections:
-    print(f"Processing section {section}")
-    df = parse_csvs(glob(f"output*/section_{section}*.csv"))
-    print(f"Saving section {section}")
-    total = total + len(df)
-    df.to_csv(f"output_merged/section_{section}.csv")
+    total = 0
+    for section in sections:
+        print(f"Processing section {section}")
+        csv_files = section_inputs(section, args.closed_only)
+        if args.incremental:
+            _, rows = write_increment(
+                section, csv_files, "output_merged", args.batch_size, args.dedup
+            )
+        else:
+            rows = write_section(
+                csv_files, f"output_merged/section_{section}.csv", args.batch_size, args.dedup
+            )
+        total = total + rows
 
-print(f"Exported {total} rows")
\ No newline at end of file
+    print(f"Exported {total} rows")
\ No newline at end of file
@@ -0,0 +1,82 @@
+from argparse import ArgumentParser
+
+import pandas
+
+quantiles = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+
+def rollup(res, freq="D", quantiles=quantiles):
+    """
+    Price summary of search results per time bin (pandas offset alias, D or W).
+
+    Returns a DataFrame indexed by the start of the bin with the count, mean and
+    quantiles of the price, empty bins are left out.
+    """
+    prices = res.dropna(subset=["price"]).set_index("datetime")["price"].sort_index()
+    bins = prices.resample(freq)
+    summary = pandas.DataFrame({"count": bins.count(), "mean": bins.mean()})
+    for q in quantiles:
+        summary[f"q{int(q * 100)}"] = bins.quantile(q)
+    return summary[summary["count"] > 0]
+
+
+def smooth(summary, column="q50", frac=0.2):
+    # lowess over the bins instead of the rows, a few hundred points for two years of days
+    # imported here, the query server only needs rollup()
+    import statsmodels.api as sm
+
+    timestamps = summary.index.asi8 / 1e9
+    smoothed = sm.nonparametric.lowess(summary[column].to_numpy(), timestamps, frac=frac)
+    return pandas.Series(
+        smoothed[:, 1],
+        index=pandas.to_datetime(smoothed[:, 0], unit="s", utc=True).tz_convert(summary.index.tz),
+    )
+
+
+def plot(res, title, freq="D", frac=0.2, max_points=20000):
+    """
+    The plot() of the example notebook, smoothing the per-bin median price instead of every row.
+
+    At most max_points of the rows are drawn, sampled at random, the band shows the
+    quartiles of the bins.
+    """
+    import matplotlib.pyplot as plt
+
+    summary = rollup(res, freq)
+    points = res.dropna(subset=["price"])
+    if len(points) > max_points:
+        points = points.sample(max_points, random_state=0)
+
+    plt.plot(points["datetime"], points["price"], ".", alpha=0.6)
+    if len(summary) > 1:
+        trend = smooth(summary, frac=frac)
+        plt.plot(trend.index, trend.to_numpy())
+        plt.fill_between(
+            summary.index,
+            smooth(summary, "q25", frac).to_numpy(),
+            smooth(summary, "q75", frac).to_numpy(),
+            alpha=0.2,
+        )
+    plt.title(title)
+    plt.grid()
+    ax = plt.gca()
+    for label in ax.get_xticklabels(which='major'):
+        label.set(rotation=30, horizontalalignment='right')
+    plt.xlabel("Datum")
+    plt.ylabel("Cena (Kč)")
+    return summary
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser(description="Precompute the price rollups of whole sections")
+    ap.add_argument("csv_files", type=str, nargs="+", help="Section CSVs as published")
+    ap.add_argument("--freq", type=str, default="D", help="Bin size, D for days or W for weeks")
+    args = ap.parse_args()
+
+    for csv_file in args.csv_files:
+        df = pandas.read_csv(csv_file, usecols=["price", "datetime"], dtype={"price": float})
+        df["datetime"] = pandas.to_datetime(df["datetime"], utc=True).dt.tz_convert("Europe/Prague")
+        summary = rollup(df, args.freq)
+        output_path = f"{csv_file.split('.csv')[0]}_rollup_{args.freq}.csv"
+        summary.to_csv(output_path)
+        print(f"{csv_file}: {len(summary)} bins written to {output_path}")
@@ -0,0 +1,78 @@
+import time
+import xml.etree.ElementTree as ET
+from email.utils import mktime_tz, parsedate_tz
+
+# the Bazos RSS item elements and the feedparser keys they are exposed under
+item_fields = {
+    "title": "title",
+    "description": "summary",
+    "link": "link",
+    "pubDate": "published",
+}
+required_fields = ["title", "link", "published"]
+
+
+class FeedFormatError(Exception):
+    pass
+
+
+def parse_date(published):
+    parsed = parsedate_tz(published)
+    if parsed is None or parsed[9] is None:
+        raise FeedFormatError(f"Cannot parse date {published!r}")
+    # same UTC struct_time as feedparser's published_parsed
+    return time.gmtime(mktime_tz(parsed))
+
+
+def parse_feed(body, chunk_size=64 * 1024):
+    """
+    Parses the items of a Bazos RSS 2.0 feed into feedparser-like entries.
+
+    Only title, summary, link and published (plus published_parsed) are extracted.
+    Unlike feedparser, the summary HTML is not sanitized.
+    Raises FeedFormatError when the document does not look like a Bazos feed,
+    the caller is expected to fall back to feedparser in that case.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    entries = []
+    depth = 0
+    root_checked = False
+    try:
+        for start in range(0, len(body), chunk_size):
+            parser.feed(body[start : start + chunk_size])
+            for event, element in parser.read_events():
+                if event == "start":
+                    depth += 1
+                    if not root_checked:
+                        if element.tag != "rss":
+                            raise FeedFormatError(f"Unexpected root {element.tag}")
+                        root_checked = True
+                    elif depth == 2 and element.tag != "channel":
+                        raise FeedFormatError(f"Unexpected element {element.tag}")
+                    continue
+
+                depth -= 1
+                if element.tag != "item" or depth != 2:
+                    continue
+
+                entry = {}
+                for child in element:
+                    key = item_fields.get(child.tag)
+                    if key is not None:
+                        entry[key] = (child.text or "").strip()
+                # free the parsed item, the feed is processed incrementally
+                element.clear()
+
+                for key in required_fields:
+                    if not entry.get(key):
+                        raise FeedFormatError(f"Item without {key}")
+                entry.setdefault("summary", "")
+                entry["published_parsed"] = parse_date(entry["published"])
+                entries.append(entry)
+        parser.close()
+    except ET.ParseError as e:
+        raise FeedFormatError(str(e)) from e
+
+    if not root_checked:
+        raise FeedFormatError("Empty document")
+    return entries
@@ -0,0 +1,419 @@
+from argparse import ArgumentParser
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import time
+
+import numpy
+import pandas
+
+# terms with these characters are regular expressions for str.contains, the index can not answer them
+regex_characters = set(".^$*+?{}[]\\|()")
+
+
+def normalize_keywords(keywords, lowercase=True):
+    # the same shapes as search() in the example notebook accepts
+    if type(keywords) == str:
+        keywords = [keywords]
+    keywords = [[k] if type(k) == str else k for k in keywords]
+    if lowercase:
+        keywords = [[kk.lower() for kk in k] for k in keywords]
+    return keywords
+
+
+def trigram_codes(data):
+    # codes of all byte trigrams of data, 0 bytes separate the titles
+    arr = numpy.frombuffer(data, dtype=numpy.uint8).astype(numpy.int64)
+    if len(arr) < 3:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=bool)
+    codes = (arr[:-2] << 16) | (arr[1:-1] << 8) | arr[2:]
+    valid = (arr[:-2] != 0) & (arr[1:-1] != 0) & (arr[2:] != 0)
+    return codes, valid
+
+
+def data_fingerprint(paths):
+    """
+    Digest of the paths, sizes and modification times of the files an index is built from.
+    """
+    sha = hashlib.sha256()
+    for path in sorted(paths):
+        stat = os.stat(path)
+        sha.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return sha.hexdigest()
+
+
+class TrigramIndex:
+    """
+    Inverted index from the UTF-8 byte trigrams of the lowercased titles to row positions.
+
+    The postings are stored as CSR: the sorted trigram codes, the offsets of their
+    postings in rows and the row positions, each posting list sorted.
+    """
+
+    def __init__(self, codes, indptr, rows, num_rows, fingerprint=None):
+        self.codes = codes
+        self.indptr = indptr
+        self.rows = rows
+        self.num_rows = num_rows
+        # of the data the index was built from, see data_fingerprint()
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def build(cls, titles, chunk_size=500000, fingerprint=None):
+        titles = pandas.Series(titles).fillna("")
+        keys = []
+        for start in range(0, len(titles), chunk_size):
+            chunk = titles.iloc[start : start + chunk_size].str.lower()
+            encoded = [t.encode() for t in chunk]
+            data = b"\0".join(encoded)
+            lengths = numpy.array([len(e) + 1 for e in encoded], dtype=numpy.int64)
+            # row of the trigram starting at every byte
+            position_rows = numpy.repeat(
+                numpy.arange(start, start + len(encoded), dtype=numpy.int64), lengths
+            )[: len(data)]
+            codes, valid = trigram_codes(data)
+            keys.append(
+                numpy.unique((codes[valid] << 32) | position_rows[: len(codes)][valid])
+            )
+        keys = numpy.sort(numpy.concatenate(keys)) if keys else numpy.zeros(0, dtype=numpy.int64)
+        codes, counts = numpy.unique(keys >> 32, return_counts=True)
+        indptr = numpy.zeros(len(codes) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=indptr[1:])
+        rows = (keys & 0xFFFFFFFF).astype(numpy.int32)
+        return cls(codes.astype(numpy.int32), indptr, rows, len(titles), fingerprint)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        numpy.save(os.path.join(path, "codes.npy"), self.codes)
+        numpy.save(os.path.join(path, "indptr.npy"), self.indptr)
+        numpy.save(os.path.join(path, "rows.npy"), self.rows)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"num_rows": self.num_rows, "fingerprint": self.fingerprint}, f)
+
+    @classmethod
+    def load(cls, path):
+        # memory mapped, only the touched posting lists are read from disk
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        return cls(
+            numpy.load(os.path.join(path, "codes.npy"), mmap_mode="r"),
+            numpy.load(os.path.join(path, "indptr.npy"), mmap_mode="r"),
+            numpy.load(os.path.join(path, "rows.npy"), mmap_mode="r"),
+            meta["num_rows"],
+            meta.get("fingerprint"),
+        )
+
+    def matches(self, num_rows, fingerprint):
+        # an index of other data with the same number of rows would point at wrong rows
+        return self.num_rows == num_rows and self.fingerprint == fingerprint
+
+    def postings(self, code):
+        i = numpy.searchsorted(self.codes, code)
+        if i == len(self.codes) or self.codes[i] != code:
+            return numpy.zeros(0, dtype=numpy.int32)
+        return numpy.asarray(self.rows[self.indptr[i] : self.indptr[i + 1]])
+
+    def candidates(self, term):
+        """
+        Rows that contain all trigrams of the lowercase term, None when it is shorter than 3 bytes.
+        """
+        codes, _ = trigram_codes(term.encode())
+        if len(codes) == 0:
+            return None
+        # the shortest posting lists first keeps the intersections small
+        lists = sorted((self.postings(c) for c in numpy.unique(codes)), key=len)
+        result = lists[0]
+        for postings in lists[1:]:
+            if len(result) == 0:
+                break
+            result = numpy.intersect1d(result, postings, assume_unique=True)
+        return result
+
+
+class TitleSearch:
+    """
+    The search() of the example notebook on top of a TrigramIndex.
+
+    Literal terms are answered from the index and verified on the candidate titles
+    only, terms with regex characters and case sensitive searches scan the rows that
+    are still left, so the results are identical to the notebook.
+    """
+
+    def __init__(self, df, index=None):
+        self.df = df
+        self.titles = df.title.to_numpy()
+        if index is None:
+            index = TrigramIndex.build(df.title)
+        if index.num_rows != len(df):
+            raise ValueError(
+                f"The index has {index.num_rows} rows, the DataFrame {len(df)}"
+            )
+        self.index = index
+
+    def term_rows(self, term, within, lowercase=True):
+        # positions from the sorted array within whose title contains term
+        if len(within) == 0:
+            return within
+        if not lowercase or regex_characters & set(term):
+            titles = pandas.Series(self.titles[within])
+            titl = titles.str.lower().str if lowercase else titles.str
+            return within[titl.contains(term).to_numpy(dtype=bool)]
+        candidates = self.index.candidates(term)
+        if candidates is not None:
+            within = numpy.intersect1d(within, candidates, assume_unique=True)
+        titles = self.titles[within]
+        matches = numpy.fromiter(
+            (term in title.lower() for title in titles), dtype=bool, count=len(titles)
+        )
+        return within[matches]
+
+    def cnf_rows(self, keywords, within, lowercase=True):
+        # rows of within satisfying all clauses, each by at least one of its terms
+        for clause in keywords:
+            matched = [self.term_rows(term, within, lowercase) for term in clause]
+            within = numpy.unique(numpy.concatenate(matched)) if matched else within
+        return within
+
+    def price_rows(self, price_lower=None, price_upper=None):
+        mask = numpy.ones(len(self.df), dtype=bool)
+        if price_lower is not None:
+            mask &= (self.df.price >= price_lower).to_numpy()
+        if price_upper is not None:
+            mask &= (self.df.price <= price_upper).to_numpy()
+        return numpy.flatnonzero(mask)
+
+    def search(self, keywords=[], filter_keywords=[], price_lower=None, price_upper=None, unique=False, lowercase=True):
+        keywords = normalize_keywords(keywords, lowercase)
+        filter_keywords = normalize_keywords(filter_keywords, lowercase)
+
+        rows = self.price_rows(price_lower, price_upper)
+        rows = self.cnf_rows(keywords, rows, lowercase)
+        if filter_keywords:
+            rows = numpy.setdiff1d(rows, self.cnf_rows(filter_keywords, rows, lowercase), assume_unique=True)
+        df_filtered = self.df.iloc[rows].sort_values("datetime")
+        if unique:
+            df_filtered = df_filtered.groupby(["title", "price"]).first().reset_index().sort_values("datetime")
+        return df_filtered
+
+
+class SearchEngine(TitleSearch):
+    """
+    TitleSearch with a query planner and a cache of term results.
+
+    The price range comes from a sorted price index. The price range and the
+    keyword clauses are evaluated from the most selective one, estimated from the
+    posting list lengths, so the later ones only check the rows that are left.
+    The rows of every literal term are kept in an LRU cache keyed by the
+    normalized term, follow-up queries reuse them.
+    """
+
+    def __init__(self, df, index=None, cache_size=256):
+        super().__init__(df, index)
+        self.all_rows = numpy.arange(len(df))
+        self.prices = df.price.to_numpy(dtype="float64")
+        priced = numpy.flatnonzero(~numpy.isnan(self.prices))
+        self.price_order = priced[numpy.argsort(self.prices[priced], kind="stable")]
+        self.sorted_prices = self.prices[self.price_order]
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self.last_plan = []
+
+    def price_range(self, price_lower=None, price_upper=None):
+        low, high = 0, len(self.sorted_prices)
+        if price_lower is not None:
+            low = numpy.searchsorted(self.sorted_prices, price_lower, side="left")
+        if price_upper is not None:
+            high = numpy.searchsorted(self.sorted_prices, price_upper, side="right")
+        return low, max(high, low)
+
+    def price_rows(self, price_lower=None, price_upper=None):
+        if price_lower is None and price_upper is None:
+            return self.all_rows
+        low, high = self.price_range(price_lower, price_upper)
+        return numpy.sort(self.price_order[low:high])
+
+    def filter_price(self, rows, price_lower=None, price_upper=None):
+        prices = self.prices[rows]
+        mask = numpy.ones(len(rows), dtype=bool)
+        if price_lower is not None:
+            mask &= prices >= price_lower
+        if price_upper is not None:
+            mask &= prices <= price_upper
+        return rows[mask]
+
+    def indexed(self, term, lowercase=True):
+        return lowercase and not regex_characters & set(term) and len(term.encode()) >= 3
+
+    def estimate(self, term, lowercase=True):
+        # upper bound of the matching rows
+        cached = self.cache.get((term, lowercase))
+        if cached is not None:
+            return len(cached)
+        if not self.indexed(term, lowercase):
+            return len(self.df)
+        codes, _ = trigram_codes(term.encode())
+        lengths = []
+        for code in numpy.unique(codes):
+            i = numpy.searchsorted(self.index.codes, code)
+            if i == len(self.index.codes) or self.index.codes[i] != code:
+                return 0
+            lengths.append(self.index.indptr[i + 1] - self.index.indptr[i])
+        return int(min(lengths))
+
+    def clause_estimate(self, clause, lowercase=True):
+        return min(sum(self.estimate(term, lowercase) for term in clause), len(self.df))
+
+    def term_rows(self, term, within, lowercase=True):
+        if len(within) == 0:
+            return within
+        key = (term, lowercase)
+        rows = self.cache.get(key)
+        if rows is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+        elif self.indexed(term, lowercase) or len(within) == len(self.df):
+            # evaluated on the whole table so that the result can be reused
+            self.misses += 1
+            rows = super().term_rows(term, self.all_rows, lowercase)
+            self.cache[key] = rows
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        else:
+            # a regex or a short term on a few rows, cheaper to scan them than to cache
+            return super().term_rows(term, within, lowercase)
+        if len(within) == len(self.df):
+            return rows
+        return numpy.intersect1d(rows, within, assume_unique=True)
+
+    def cnf_rows(self, keywords, within, lowercase=True):
+        keywords = sorted(keywords, key=lambda clause: self.clause_estimate(clause, lowercase))
+        return super().cnf_rows(keywords, within, lowercase)
+
+    def search(self, keywords=[], filter_keywords=[], price_lower=None, price_upper=None, unique=False, lowercase=True):
+        keywords = normalize_keywords(keywords, lowercase)
+        filter_keywords = normalize_keywords(filter_keywords, lowercase)
+
+        plan = [(self.clause_estimate(clause, lowercase), "keywords", clause) for clause in keywords]
+        if price_lower is not None or price_upper is not None:
+            low, high = self.price_range(price_lower, price_upper)
+            plan.append((high - low, "price", (price_lower, price_upper)))
+        plan.sort(key=lambda step: step[0])
+        self.last_plan = plan
+
+        rows = self.all_rows
+        for _, kind, predicate in plan:
+            if kind == "price":
+                if len(rows) == len(self.df):
+                    rows = self.price_rows(*predicate)
+                else:
+                    rows = self.filter_price(rows, *predicate)
+            else:
+                rows = super().cnf_rows([predicate], rows, lowercase)
+        if filter_keywords:
+            rows = numpy.setdiff1d(rows, self.cnf_rows(filter_keywords, rows, lowercase), assume_unique=True)
+        df_filtered = self.df.iloc[rows].sort_values("datetime")
+        if unique:
+            df_filtered = df_filtered.groupby(["title", "price"]).first().reset_index().sort_values("datetime")
+        return df_filtered
+
+
+def search_scan(df, keywords=[], filter_keywords=[], price_lower=None, price_upper=None, unique=False, lowercase=True):
+    """
+    search() of the example notebook, a full scan per term, the reference for TitleSearch.
+    """
+    df_filtered = df
+
+    if price_lower is not None:
+        df_filtered = df_filtered[(df_filtered.price >= price_lower)]
+    if price_upper is not None:
+        df_filtered = df_filtered[(df_filtered.price <= price_upper)]
+    titl = df_filtered.title.str
+    if lowercase:
+        titl = titl.lower().str
+
+    keywords = normalize_keywords(keywords, lowercase)
+    filter_keywords = normalize_keywords(filter_keywords, lowercase)
+
+    def _create_query(kwords):
+        query = titl.contains("")
+        for k in kwords:
+            contains = None
+            for k_or in k:
+                if contains is None:
+                    contains = titl.contains(k_or)
+                else:
+                    contains = contains | titl.contains(k_or)
+
+            if query is None:
+                query = contains
+            else:
+                query = query & contains
+        return query
+
+    query = _create_query(keywords)
+    if filter_keywords:
+        query = query & (~_create_query(filter_keywords))
+    df_filtered = df_filtered[query].sort_values("datetime")
+    if unique:
+        df_filtered = df_filtered.groupby(["title", "price"]).first().reset_index().sort_values("datetime")
+    return df_filtered
+
+
+example_queries = [
+    (
+        [["gtx 1070"]],
+        [["1070 ti", "1070ti", "intel", "i5", "i7", "ryzen", "herní", "počítač", "laptop", "pc", "notebook"]],
+        1300,
+        10000,
+    ),
+    (["ps4 pro"], [["slim", "fat"]], 2500, 15000),
+    (["nintendo", "switch", "oled"], [["lite"]], 2000, 15000),
+]
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser(
+        description="Build the title index of a section and compare it with the full scan search"
+    )
+    ap.add_argument("csv_file", type=str, help="Section CSV as published")
+    ap.add_argument("--index", type=str, default=None, help="Index directory, built when missing")
+    args = ap.parse_args()
+
+    df = pandas.read_csv(args.csv_file, dtype={"price": float})
+    df["datetime"] = pandas.to_datetime(df["datetime"], utc=True).dt.tz_convert("Europe/Prague")
+    index_path = args.index or os.path.splitext(args.csv_file)[0] + ".trigrams"
+    fingerprint = data_fingerprint([args.csv_file])
+    index = None
+    if os.path.exists(index_path):
+        index = TrigramIndex.load(index_path)
+        if not index.matches(len(df), fingerprint):
+            print(f"The index in {index_path} is out of date, rebuilding it")
+            index = None
+    if index is None:
+        start = time.perf_counter()
+        index = TrigramIndex.build(df.title, fingerprint=fingerprint)
+        index.save(index_path)
+        print(f"Built the index of {len(df)} rows in {time.perf_counter() - start:.1f} s")
+    searcher = TitleSearch(df, index)
+    engine = SearchEngine(df, index)
+
+    for keywords, filter_keywords, price_lower, price_upper in example_queries:
+        query = (keywords, filter_keywords, price_lower, price_upper)
+        timings = {}
+        results = {}
+        for name, run in [
+            ("scan", lambda: search_scan(df, *query)),
+            ("index", lambda: searcher.search(*query)),
+            ("planner", lambda: engine.search(*query)),
+            ("cached", lambda: engine.search(*query)),
+        ]:
+            start = time.perf_counter()
+            results[name] = run()
+            timings[name] = time.perf_counter() - start
+        same = all(results["scan"].equals(r) for r in results.values())
+        times = ", ".join(f"{name} {t * 1000:.0f} ms" for name, t in timings.items())
+        print(f"{keywords}: {len(results['scan'])} rows, {times}, identical {same}")
+    print(f"Term cache: {engine.hits} hits, {engine.misses} misses")
@@ -0,0 +1,226 @@
+from argparse import ArgumentParser
+from collections import OrderedDict
+from glob import glob
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import re
+import threading
+import time
+import urllib.request
+
+import pandas
+
+from bazos_rollup import rollup
+from bazos_search import SearchEngine, TrigramIndex, data_fingerprint
+
+
+def load_section(section, source="csv", data_dir="anon_output_merged", index_dir="trigram_index"):
+    if source == "parquet":
+        from bazos_dataset import dataset_root, load
+
+        df = load(sections=[section], columns=["title", "price", "price_string", "link", "datetime"])
+        # the dataset has the rows in another order than the CSV
+        files = glob(os.path.join(dataset_root, f"section={section}", "**", "*.parquet"), recursive=True)
+    else:
+        csv_file = os.path.join(data_dir, f"section_{section}.csv")
+        if not os.path.exists(csv_file):
+            csv_file += ".gz"
+        df = pandas.read_csv(csv_file, dtype={"price": float})
+        df["datetime"] = pandas.to_datetime(df["datetime"], utc=True).dt.tz_convert("Europe/Prague")
+        files = [csv_file]
+
+    fingerprint = data_fingerprint(files)
+    index_path = os.path.join(index_dir, f"section_{section}_{source}")
+    index = None
+    if os.path.exists(index_path):
+        index = TrigramIndex.load(index_path)
+        if not index.matches(len(df), fingerprint):
+            logging.info(f"Index of section {section} is out of date")
+            index = None
+    if index is None:
+        index = TrigramIndex.build(df.title, fingerprint=fingerprint)
+        index.save(index_path)
+    return SearchEngine(df, index)
+
+
+class QueryService:
+    """
+    Keeps the search engines of the loaded sections and a cache of the responses.
+
+    A search engine is used by one request at a time, different sections are
+    queried concurrently.
+    """
+
+    def __init__(self, engines, cache_size=1024):
+        self.engines = engines
+        self.locks = {section: threading.Lock() for section in engines}
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_lock = threading.Lock()
+
+    def results(self, query):
+        section = query["section"]
+        if section not in self.engines:
+            raise KeyError(f"Section {section} is not loaded")
+        with self.locks[section]:
+            res = self.engines[section].search(
+                query.get("keywords", []),
+                query.get("filter_keywords", []),
+                query.get("price_lower"),
+                query.get("price_upper"),
+                query.get("unique", False),
+                query.get("lowercase", True),
+            )
+        if query.get("start") is not None:
+            res = res[res["datetime"] >= pandas.Timestamp(query["start"], tz="Europe/Prague")]
+        if query.get("end") is not None:
+            res = res[res["datetime"] < pandas.Timestamp(query["end"], tz="Europe/Prague")]
+        return res
+
+    def search(self, query):
+        res = self.results(query)
+        limit = query.get("limit", 1000)
+        return {
+            "count": len(res),
+            "rows": json.loads(res.tail(limit).to_json(orient="records", date_format="iso", force_ascii=False)),
+        }
+
+    def history(self, query):
+        summary = rollup(self.results(query), query.get("freq", "D")).reset_index()
+        return {"bins": json.loads(summary.to_json(orient="records", date_format="iso"))}
+
+    def sections(self, query):
+        return {section: len(engine.df) for section, engine in self.engines.items()}
+
+    def handle(self, endpoint, query):
+        key = json.dumps([endpoint, query], sort_keys=True)
+        with self.cache_lock:
+            body = self.cache.get(key)
+            if body is not None:
+                self.cache.move_to_end(key)
+                return body
+        body = json.dumps(getattr(self, endpoint)(query), ensure_ascii=False).encode()
+        with self.cache_lock:
+            self.cache[key] = body
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return body
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    endpoints = {"/search": "search", "/history": "history", "/sections": "sections"}
+
+    def respond(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        endpoint = self.endpoints.get(self.path)
+        if endpoint is None:
+            self.respond(404, json.dumps({"error": f"Unknown endpoint {self.path}"}).encode())
+            return
+        start = time.monotonic()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            query = json.loads(self.rfile.read(length) or b"{}")
+            body = self.server.service.handle(endpoint, query)
+        except (KeyError, ValueError, TypeError, re.error) as e:
+            self.respond(400, json.dumps({"error": str(e)}).encode())
+            return
+        self.respond(200, body)
+        logging.info(f"{self.path} answered in {(time.monotonic() - start) * 1000:.0f} ms")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(service, host="127.0.0.1", port=8765):
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.service = service
+    logging.info(f"Serving {', '.join(service.engines)} on http://{host}:{port}")
+    server.serve_forever()
+
+
+def request(endpoint, query, url="http://127.0.0.1:8765"):
+    data = json.dumps(query).encode()
+    req = urllib.request.Request(
+        url + endpoint, data=data, headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(req) as response:
+        return json.loads(response.read())
+
+
+def parse_clauses(clauses):
+    # every argument is one clause, the alternatives in it are separated by commas
+    return [[term.strip() for term in clause.split(",")] for clause in clauses or []]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    ap = ArgumentParser(description="Local query server of the Bazos dataset and its client")
+    subparsers = ap.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Load the sections and answer queries")
+    serve_parser.add_argument("sections", type=str, nargs="+")
+    serve_parser.add_argument("--source", type=str, default="csv", choices=["csv", "parquet"])
+    serve_parser.add_argument("--data-dir", type=str, default="anon_output_merged")
+    serve_parser.add_argument("--index-dir", type=str, default="trigram_index")
+    serve_parser.add_argument("--host", type=str, default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+
+    for command in ["search", "history"]:
+        query_parser = subparsers.add_parser(command, help=f"Send a {command} query to the server")
+        query_parser.add_argument("section", type=str)
+        query_parser.add_argument(
+            "--keywords",
+            type=str,
+            nargs="+",
+            help="Clauses that must all match, alternatives separated by commas",
+        )
+        query_parser.add_argument(
+            "--exclude",
+            type=str,
+            nargs="+",
+            help="Clauses that must not all match, alternatives separated by commas",
+        )
+        query_parser.add_argument("--price-lower", type=float)
+        query_parser.add_argument("--price-upper", type=float)
+        query_parser.add_argument("--start", type=str, help="First day, Prague time")
+        query_parser.add_argument("--end", type=str, help="Day after the last one, Prague time")
+        query_parser.add_argument("--unique", action="store_true")
+        query_parser.add_argument("--limit", type=int, default=20)
+        query_parser.add_argument("--freq", type=str, default="D")
+        query_parser.add_argument("--url", type=str, default="http://127.0.0.1:8765")
+    args = ap.parse_args()
+
+    if args.command == "serve":
+        engines = {}
+        for section in args.sections:
+            start = time.monotonic()
+            engines[section] = load_section(section, args.source, args.data_dir, args.index_dir)
+            logging.info(f"Loaded section {section} in {time.monotonic() - start:.1f} s")
+        serve(QueryService(engines), args.host, args.port)
+    else:
+        query = {
+            "section": args.section,
+            "keywords": parse_clauses(args.keywords),
+            "filter_keywords": parse_clauses(args.exclude),
+            "price_lower": args.price_lower,
+            "price_upper": args.price_upper,
+            "start": args.start,
+            "end": args.end,
+            "unique": args.unique,
+        }
+        if args.command == "search":
+            query["limit"] = args.limit
+        else:
+            query["freq"] = args.freq
+        print(json.dumps(request("/" + args.command, query, args.url), indent=1, ensure_ascii=False))
@@ -0,0 +1,72 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class WatcherStateStore:
+    def __init__(self, path):
+        self.path = path
+        # loaded by the main thread, then written by the writer thread
+        # the scraper workers may share the file, wait for each other's transactions
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.lock = threading.Lock()
+        # WAL keeps the readers working while a checkpoint is written
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS watchers ("
+            "id TEXT PRIMARY KEY, state TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self.conn.commit()
+
+    def load(self, id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT state FROM watchers WHERE id = ?", (id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def load_all(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT id, state FROM watchers").fetchall()
+        return {id: json.loads(state) for id, state in rows}
+
+    def save(self, id, state):
+        # every poll is one transaction, a crash leaves the previous checkpoint intact
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO watchers (id, state, updated) VALUES (?, ?, ?)",
+                (id, json.dumps(state), time.time()),
+            )
+
+    def save_many(self, states):
+        updated = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO watchers (id, state, updated) VALUES (?, ?, ?)",
+                [(id, json.dumps(state), updated) for id, state in states.items()],
+            )
+
+    def load_meta(self, key):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM meta WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def save_meta(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (key, json.dumps(value)),
+            )
+
+    def close(self):
+        self.conn.close()
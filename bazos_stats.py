@@ -1,6 +1,4 @@
-import pandas
-from glob import glob
-import os
+from bazos_manifest import load_manifest
 
 category_names = {
     'zv': 'Zvířata',
@@ -24,10 +22,11 @@ category_names = {
     'sl': 'Služby',
     'os': 'Ostatní',
 }
-files = glob("anon_output_merged/*.pkl.gz")
-files = sorted(files, key=os.path.getsize, reverse=True)
+# only the manifest is read, see bazos_manifest.py
+manifest = load_manifest("anon_output_merged")
+stats = sorted(manifest["sections"].items(), key=lambda item: item[1]["rows"], reverse=True)
 
-for file in files:
-    section = file.split("section_")[1].split(".pkl.gz")[0]
-    df = pandas.read_pickle("anon_output_merged/section_" + section + ".pkl.gz")
-    print("|", category_names[section], "|", len(df), "|", f"https://jirkabalhar.cz/bazos/section_{section}.pkl.gz", "|")
\ No newline at end of file
+print("| Category | Number of posts | Link |")
+print("| --- | --- | --- |")
+for section, section_stats in stats:
+    print("|", category_names[section], "|", section_stats["rows"], "|", f"https://jirkabalhar.cz/bazos/section_{section}.csv.gz", "|")
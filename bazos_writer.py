@@ -0,0 +1,121 @@
+import csv
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+segment_pattern = re.compile(r"_(\d{4}-\d{2})\.csv$")
+
+
+def current_month():
+    return time.strftime("%Y-%m", time.gmtime())
+
+
+def segment_path(output_path, month):
+    root, ext = os.path.splitext(output_path)
+    return f"{root}_{month}{ext}"
+
+
+def closed_segments(paths, month=None):
+    # segments of past months are not written to anymore, files without a month are legacy output
+    if month is None:
+        month = current_month()
+    closed = []
+    for path in paths:
+        match = segment_pattern.search(path)
+        if match is None or match.group(1) < month:
+            closed.append(path)
+    return closed
+
+
+class EntryWriter:
+    def __init__(self, fieldnames, state_store=None, flush_interval=5, fsync=False):
+        self.fieldnames = fieldnames
+        self.state_store = state_store
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.queue = queue.Queue()
+        # open segments, output path -> (month, file, csv writer)
+        self.handles = {}
+        self.pending_states = {}
+        self.thread = threading.Thread(target=self.run, name="writer", daemon=True)
+        self.logger = logging.getLogger(name="writer")
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, output_path, entries, id=None, state=None):
+        self.queue.put((output_path, entries, id, state))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _handle(self, output_path):
+        month = current_month()
+        handle = self.handles.get(output_path)
+        if handle is not None and handle[0] != month:
+            self.logger.info(f"Closing the {handle[0]} segment of {output_path}")
+            handle[1].close()
+            handle = None
+        if handle is None:
+            f = open(segment_path(output_path, month), "a", newline="")
+            handle = (month, f, csv.DictWriter(f, fieldnames=self.fieldnames))
+            self.handles[output_path] = handle
+        return handle
+
+    def _write(self, output_path, entries, id, state):
+        if entries:
+            path = segment_path(output_path, current_month())
+            self.logger.info(f"Writing {len(entries)} new entries to {path}")
+            self._handle(output_path)[2].writerows(entries)
+        if id is not None:
+            self.pending_states[id] = state
+
+    def flush(self):
+        for _, f, _ in self.handles.values():
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        # the checkpoint follows the data, a crash before this point only repeats a fetch
+        if self.state_store is not None and self.pending_states:
+            self.state_store.save_many(self.pending_states)
+        self.pending_states = {}
+
+    def run(self):
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(self.flush_interval - (time.monotonic() - last_flush), 0)
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+
+            # group commit, write everything that is queued and flush once
+            stop = item is None
+            items = [item] if item else []
+            while not stop:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                else:
+                    items.append(item)
+            for item in items:
+                try:
+                    self._write(*item)
+                except Exception:
+                    self.logger.exception(f"Failed to write entries to {item[0]}")
+
+            if stop or time.monotonic() - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = time.monotonic()
+            if stop:
+                for _, f, _ in self.handles.values():
+                    f.close()
+                self.handles = {}
+                return
@@ -0,0 +1,48 @@
+import csv
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+import os
+
+import pytest
+
+pytest.importorskip("pandas")
+
+from bazos_anonymize import anonymize_file
+from bazos_compress import load_index, read_blocks
+from bazos_postprocess import section_inputs, write_section
+
+
+def test_blocks_of_legacy_category_files_cover_short_ranges(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("output")
+    os.makedirs("output_merged")
+    start = datetime(2022, 5, 1, tzinfo=timezone.utc)
+    # four legacy category files, each covering the whole May to December
+    for category in range(4):
+        with open(f"output/section_pc_{category}.csv", "w", newline="") as f:
+            writer = csv.writer(f)
+            for i in range(5000):
+                n = category * 5000 + i
+                published = start + timedelta(minutes=70 * i + 17 * category)
+                writer.writerow(
+                    [
+                        f"Notebook {n} - {1000 + n}",
+                        "popis",
+                        f"https://pc.bazos.cz/inzerat/{100000 + n}/notebook.php",
+                        format_datetime(published),
+                        f"Kategorie {category}",
+                    ]
+                )
+
+    write_section(section_inputs("pc"), "output_merged/section_pc.csv")
+    anonymize_file("output_merged/section_pc.csv", "section_pc.csv", chunksize=1000, compress=True)
+
+    blocks = load_index("section_pc.csv.gz")["blocks"]
+    assert sum(block["rows"] for block in blocks) == 20000
+    assert all(a["max_datetime"] <= b["min_datetime"] for a, b in zip(blocks, blocks[1:]))
+
+    week = read_blocks("section_pc.csv.gz", "2022-06-01", "2022-06-08")
+    # a week is about 580 rows, at most two partly used blocks more
+    assert len(week) <= 580 + 2 * 1000
+    in_range = week[(week["datetime"] >= "2022-06-01") & (week["datetime"] < "2022-06-08")]
+    assert len(in_range) > 500
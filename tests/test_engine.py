@@ -0,0 +1,134 @@
+import asyncio
+import logging
+
+import pytest
+
+from bazos_engine import ScrapeEngine
+from bazos_leases import LeaseTable
+
+
+class Watcher:
+    def __init__(self, id):
+        self.id = id
+        self.url = f"https://pc.bazos.cz/rss.php?rub={id}"
+        self.next_update = 1000
+        self.interval = 600
+        self.removed = False
+        self.logger = logging.getLogger(name=id)
+        self.polls = 0
+
+    def parse_new_entries(self):
+        self.polls += 1
+        return []
+
+
+class StateStore:
+    def load(self, id):
+        return None
+
+
+class Done(Exception):
+    pass
+
+
+class ScriptedLeases:
+    """
+    Worker A of two sharing a lease table, the other worker acts between the syncs of A.
+    """
+
+    ttl = 0
+
+    def __init__(self, path):
+        self.a = LeaseTable(path, "a", ttl=120)
+        self.b = LeaseTable(path, "b", ttl=120)
+        self.held = []
+        self.steps = [
+            # A alone holds everything
+            lambda ids: self.a.sync(ids, now=0),
+            # B joins, A gives its surplus back
+            lambda ids: (self.b.sync(ids, now=10), self.a.sync(ids, now=20))[1],
+            # B takes the surplus and dies, A reclaims it once the leases expire
+            lambda ids: (self.b.sync(ids, now=30), self.a.sync(ids, now=200))[1],
+        ]
+
+    def sync(self, ids):
+        if not self.steps:
+            raise Done()
+        held = self.steps.pop(0)(ids)
+        self.held.append(held)
+        return held
+
+
+def test_reclaimed_lease_is_scheduled_once(tmp_path):
+    watchers = [Watcher(f"w{i}") for i in range(4)]
+    leases = ScriptedLeases(str(tmp_path / "leases.sqlite"))
+    engine = ScrapeEngine(
+        watchers, None, None, None, lease_table=leases, state_store=StateStore()
+    )
+
+    async def run():
+        engine.wakeup = asyncio.Event()
+        with pytest.raises(Done):
+            await engine.lease()
+
+    asyncio.run(run())
+    assert [len(held) for held in leases.held] == [4, 2, 4]
+
+    due = []
+    while (entry := engine.scheduler.pop_due(float("inf"))) is not None:
+        due.append(entry[1].id)
+    assert sorted(due) == ["w0", "w1", "w2", "w3"]
+
+
+def test_watcher_readded_during_poll_is_scheduled_once():
+    watcher = Watcher("w0")
+    engine = ScrapeEngine([watcher], None, None, None)
+    engine.wakeup = asyncio.Event()
+
+    assert engine.scheduler.pop_due(float("inf"))[1] is watcher
+    engine.polling.add(watcher)
+    engine.remove_watcher(watcher)
+    engine.add_watcher(watcher)
+    assert engine.scheduler.pop_due(float("inf")) is None
+
+    # the poll pushes it when it finishes
+    engine.polling.discard(watcher)
+    engine.scheduler.push(watcher)
+    assert engine.scheduler.pop_due(float("inf"))[1] is watcher
+    assert engine.scheduler.pop_due(float("inf")) is None
+
+
+class Breaker:
+    async def wait(self, url):
+        pass
+
+
+class GateLimiter:
+    # holds the dispatch in acquire() until the gate opens
+    def __init__(self):
+        self.waiting = asyncio.Event()
+        self.gate = asyncio.Event()
+
+    async def acquire(self, url):
+        self.waiting.set()
+        await self.gate.wait()
+
+
+def test_watcher_removed_while_waiting_for_a_token_is_not_polled():
+    watcher = Watcher("w0")
+    limiter = GateLimiter()
+    engine = ScrapeEngine([watcher], limiter, Breaker(), None)
+
+    async def run():
+        engine.in_flight = asyncio.Semaphore(1)
+        engine.wakeup = asyncio.Event()
+        dispatch = asyncio.create_task(engine.dispatch())
+        await limiter.waiting.wait()
+        engine.remove_watcher(watcher)
+        limiter.gate.set()
+        await asyncio.sleep(0.05)
+        dispatch.cancel()
+
+    asyncio.run(run())
+    assert watcher.polls == 0
+    assert not engine.in_flight.locked()
@@ -0,0 +1,76 @@
+import pytest
+
+pandas = pytest.importorskip("pandas")
+numpy = pytest.importorskip("numpy")
+
+from bazos_postprocess import (
+    parse_date_row,
+    parse_dates,
+    parse_price_row,
+    parse_prices,
+    split_title_price,
+    split_title_price_row,
+)
+
+titles = [
+    "Prodám kolo - 1 500 Kč",
+    "Prodám kolo: 1500",
+    "Wi-Fi router: 300",
+    "Wi-Fi router - 10:30 - 300",
+    "Kolo bez ceny",
+    "",
+    " - ",
+    "Auto - +5",
+    "Auto - 1_000",
+    "Auto - ١٢٣",
+    "Auto - Dohodou",
+    "Auto -\t42\xa0",
+    "Víceřádkový\ninzerát - 200",
+]
+dates = [
+    "Sun, 01 May 2022 12:00:00 +0200",
+    "Mon, 31 Oct 2022 23:59:59 +0100",
+    "Tue, 01 Nov 2022 00:00:00 +0000",
+    "Tue, 01 Nov 2022 00:00:00 -0000",
+    "Tue, 1 Nov 2022 00:00:00 +0100",
+]
+
+
+@pytest.mark.parametrize("row_title", titles)
+def test_split_title_price_matches_row_parser(row_title):
+    title, price, _ = split_title_price(pandas.Series([row_title], dtype="object"))
+    prices = parse_prices(price)
+    expected_title, expected_price = split_title_price_row(row_title)
+    assert (title[0], price[0]) == (expected_title, expected_price)
+    expected = parse_price_row(expected_price)
+    if expected is None:
+        assert numpy.isnan(prices[0])
+    else:
+        assert prices[0] == expected
+
+
+def test_columns_match_row_parser_together():
+    # the rows of a batch must not influence each other
+    title, price, _ = split_title_price(pandas.Series(titles, dtype="object"))
+    prices = parse_prices(price)
+    for i, row_title in enumerate(titles):
+        expected_title, expected_price = split_title_price_row(row_title)
+        expected = parse_price_row(expected_price)
+        assert (title[i], price[i]) == (expected_title, expected_price)
+        assert (numpy.isnan(prices[i]) and expected is None) or prices[i] == expected
+
+
+@pytest.mark.parametrize("date", dates)
+def test_parse_dates_matches_row_parser(date):
+    formatted, utc = parse_dates(pandas.Series([date], dtype="object"))
+    expected = parse_date_row(date)
+    assert formatted[0] == str(expected)
+    assert utc[0] == pandas.Timestamp(expected)
+
+
+def test_parse_dates_with_fallback_rows_in_a_batch():
+    formatted, utc = parse_dates(pandas.Series(dates, dtype="object"))
+    for i, date in enumerate(dates):
+        expected = parse_date_row(date)
+        assert formatted[i] == str(expected)
+        assert utc[i] == pandas.Timestamp(expected)
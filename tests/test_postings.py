@@ -0,0 +1,59 @@
+import pytest
+
+pandas = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+
+from bazos_dataset import load, write_parquet
+from bazos_postings import PostingBatch, load_postings
+
+rows = [
+    ["Grafická karta GTX 1060", 3500, "3 500", "https://pc.bazos.cz/inzerat/151903235/graficka-karta.php", "2022-05-01 10:00:00+02:00"],
+    ["Nvidia K2200", 7000, "7 000", "https://pc.bazos.cz/inzerat/151854632/nvidia-k2200.php", "2022-05-02 11:30:00+02:00"],
+    ["Monitor", None, "Dohodou", "https://pc.bazos.cz/inzerat/151000001/monitor.php", "2022-06-01 08:00:00+02:00"],
+    ["Kabel", None, None, "https://pc.bazos.cz/inzerat/151000002/kabel.php", "2022-06-02 09:00:00+02:00"],
+    ["Myš", 150, "150", "https://pc.bazos.cz/inzerat/151000003/mys.php", "2022-11-02 09:00:00+01:00"],
+    ["Server", 3000000000, "3 000 000 000", "https://pc.bazos.cz/inzerat/151000004/server.php", "2022-11-03 09:00:00+01:00"],
+    ["Klávesnice", 1500, "1500", "https://example.com/klavesnice", "2022-11-04 09:00:00+01:00"],
+]
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = tmp_path / "section_pc.csv"
+    pandas.DataFrame(rows, columns=["title", "price", "price_string", "link", "datetime"]).to_csv(
+        path, index=False
+    )
+    return str(path)
+
+
+def read_csv(csv_file):
+    return pandas.read_csv(csv_file, dtype={"title": str, "price_string": str, "link": str, "datetime": str})
+
+
+def test_grouped_price_strings_are_derived(csv_file):
+    postings = PostingBatch.from_frame(read_csv(csv_file))
+    # only "Dohodou" and the ungrouped "1500" differ from the grouped price
+    assert sorted(postings.price_string_exceptions.values()) == ["1500", "Dohodou"]
+    assert postings.to_frame().equals(read_csv(csv_file).fillna({"price_string": ""}).astype({"price": float}))
+
+
+def test_parquet_round_trip(csv_file, tmp_path):
+    root = str(tmp_path / "dataset")
+    write_parquet(csv_file, "pc", root)
+    postings = load(root, compact=True)
+
+    expected = read_csv(csv_file).fillna({"price_string": ""})
+    expected["datetime"] = pandas.to_datetime(expected["datetime"], utc=True)
+    frame = postings.to_frame(tz="UTC")
+    key = ["link"]
+    pandas.testing.assert_frame_equal(
+        frame.sort_values(key).reset_index(drop=True),
+        expected.astype({"price": float}).sort_values(key).reset_index(drop=True),
+        check_dtype=False,
+    )
+
+
+def test_load_postings(csv_file):
+    postings = load_postings(csv_file, chunksize=3)
+    expected = read_csv(csv_file).fillna({"price_string": ""}).astype({"price": float})
+    pandas.testing.assert_frame_equal(postings.to_frame(), expected)
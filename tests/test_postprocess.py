@@ -0,0 +1,81 @@
+import csv
+import os
+
+import pytest
+
+pytest.importorskip("pandas")
+
+from bazos_postprocess import section_inputs, write_increment, write_section
+
+
+def scrape(path, first, count, date="Sun, 01 May 2022 12:00:00 +0200"):
+    # rows like the scraper's EntryWriter writes them, without a header
+    with open(path, "a", newline="") as f:
+        writer = csv.writer(f)
+        for i in range(first, first + count):
+            writer.writerow(
+                [
+                    f"Kolo {i} - {i} 000",
+                    "popis",
+                    f"https://sp.bazos.cz/inzerat/{1000 + i}/kolo.php",
+                    date,
+                    "Kola",
+                ]
+            )
+
+
+def test_second_incremental_run_reads_only_new_rows(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("output")
+    os.makedirs("output_merged")
+    scrape("output/section_sp_2022-05.csv", 0, 3)
+
+    part, rows = write_increment("sp", section_inputs("sp"), "output_merged")
+    assert (part, rows) == ("output_merged/section_sp_part00000.csv", 3)
+    # the part itself matches output*/section_sp*.csv
+    assert section_inputs("sp") == ["output/section_sp_2022-05.csv"]
+
+    scrape("output/section_sp_2022-05.csv", 3, 2)
+    capsys.readouterr()
+    part, rows = write_increment("sp", section_inputs("sp"), "output_merged")
+    assert (part, rows) == ("output_merged/section_sp_part00001.csv", 2)
+    assert "Not enough values" not in capsys.readouterr().out
+
+    part, rows = write_increment("sp", section_inputs("sp"), "output_merged")
+    assert (part, rows) == (None, 0)
+
+
+def test_dedup_keeps_the_earliest_sighting(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("output")
+    os.makedirs("output2")
+    # ads 0 and 1 were published again later, the later copy is in the file read first
+    scrape("output/section_sp.csv", 0, 3, "Fri, 01 Jul 2022 12:00:00 +0200")
+    scrape("output2/section_sp.csv", 0, 2, "Sun, 01 May 2022 12:00:00 +0200")
+    scrape("output2/section_sp.csv", 2, 1, "Wed, 01 Jun 2022 12:00:00 +0200")
+
+    os.makedirs("output_merged")
+    rows = write_section(section_inputs("sp"), "output_merged/section_sp.csv", batch_size=2, dedup=True)
+    assert rows == 3
+
+    with open("output_merged/section_sp.csv", newline="") as f:
+        dates = {row["link"]: row["datetime"] for row in csv.DictReader(f)}
+    assert dates == {
+        "https://sp.bazos.cz/inzerat/1000/kolo.php": "2022-05-01 12:00:00+02:00",
+        "https://sp.bazos.cz/inzerat/1001/kolo.php": "2022-05-01 12:00:00+02:00",
+        "https://sp.bazos.cz/inzerat/1002/kolo.php": "2022-06-01 12:00:00+02:00",
+    }
+
+
+def test_incremental_dedup_drops_ads_of_previous_parts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("output")
+    os.makedirs("output_merged")
+    scrape("output/section_sp_2022-05.csv", 0, 2)
+    assert write_increment("sp", section_inputs("sp"), "output_merged", dedup=True)[1] == 2
+
+    # ad 1 again and two new ads, one of them twice
+    scrape("output/section_sp_2022-05.csv", 1, 3)
+    scrape("output/section_sp_2022-05.csv", 3, 1)
+    part, rows = write_increment("sp", section_inputs("sp"), "output_merged", dedup=True)
+    assert rows == 2
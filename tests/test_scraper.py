@@ -0,0 +1,30 @@
+from email.utils import formatdate
+
+import pytest
+
+pytest.importorskip("feedparser")
+
+from bazos_scraper import FeedWatcher
+
+
+def category_keys(category, start):
+    # the recent keys of one category watcher, oldest first
+    return [
+        f"https://pc.bazos.cz/inzerat/{category * 1000 + i}/x.php {formatdate(start + 60 * (40 * i + category))}"
+        for i in range(200)
+    ]
+
+
+def test_merged_keys_keep_the_normal_bound():
+    watcher = FeedWatcher("pc", "https://pc.bazos.cz/rss.php", "section_pc", "pc", None)
+    keys = [key for category in range(40) for key in category_keys(category, 1651363200)]
+    watcher.seed(1651363200, keys)
+
+    assert len(watcher.recent_keys) == 200
+    newest = sorted(keys, key=watcher._key_published)[-200:]
+    assert watcher.recent_key_set == set(newest)
+
+    restarted = FeedWatcher("pc", "https://pc.bazos.cz/rss.php", "section_pc", "pc", None)
+    restarted.load_state(watcher.to_state())
+    assert len(restarted.recent_keys) == 200
+    assert restarted.recent_keys.maxlen == 200
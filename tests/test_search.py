@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+pandas = pytest.importorskip("pandas")
+pytest.importorskip("numpy")
+
+from bazos_search import SearchEngine, TitleSearch, TrigramIndex, example_queries, search_scan
+
+words = [
+    "Nové", "nový", "PS4", "ps4 pro", "Slim", "fat", "GTX 1060", "gtx1060", "RTX 3060", "Nintendo",
+    "Switch", "OLED", "lite", "kolo", "Kolo", "žluté", "Žluté", "čtyřkolka", "a", "x", "(vadná)",
+    "c++", "50%", "1.5", "[rezervováno]", "i7-8700", "Dohodou", "ř", "ÁÉÍ", "ssd 512gb",
+]
+queries = [
+    (["ps4"], [], None, None, False, True),
+    ([["nové", "nový"]], [["vadná"]], None, None, False, True),
+    (["ps4 pro"], [["slim", "fat"]], 2500, 15000, False, True),
+    (["a"], [], None, None, False, True),
+    (["ř"], [], None, 1000, False, True),
+    (["žlut"], [], None, None, True, True),
+    (["Nové"], [], None, None, False, False),
+    (["Žluté", "kolo"], [], 100, None, True, False),
+    (["gtx.*1060"], [], None, None, False, True),
+    (["1.5"], [["c\\+\\+"]], None, None, False, True),
+    (["[rezervováno]"], [], None, None, False, True),
+    ([], [["nintendo"]], None, 500, False, True),
+    (["neexistuje"], [], None, None, False, True),
+]
+
+
+@pytest.fixture(scope="module")
+def df():
+    rng = random.Random(0)
+    n = 20000
+    titles = [" ".join(rng.choice(words) for _ in range(rng.randint(1, 6))) for _ in range(n)]
+    prices = [float(rng.randint(0, 20000)) if rng.random() > 0.1 else float("nan") for _ in range(n)]
+    datetimes = pandas.Timestamp("2022-05-01", tz="Europe/Prague") + pandas.to_timedelta(
+        [rng.randint(0, 800 * 24 * 3600) for _ in range(n)], unit="s"
+    )
+    return pandas.DataFrame(
+        {
+            "title": titles,
+            "price": prices,
+            "price_string": ["" for _ in range(n)],
+            "link": [f"https://pc.bazos.cz/inzerat/{i}/x.php" for i in range(n)],
+            "datetime": datetimes,
+        }
+    )
+
+
+@pytest.fixture(scope="module")
+def index(df):
+    return TrigramIndex.build(df.title)
+
+
+@pytest.mark.parametrize("query", queries + [q + (False, True) for q in example_queries])
+def test_index_search_matches_scan(df, index, query):
+    expected = search_scan(df, *query)
+    pandas.testing.assert_frame_equal(TitleSearch(df, index).search(*query), expected)
+
+
+@pytest.mark.parametrize("query", queries + [q + (False, True) for q in example_queries])
+def test_planned_and_cached_search_matches_scan(df, index, query):
+    expected = search_scan(df, *query)
+    engine = SearchEngine(df, index)
+    pandas.testing.assert_frame_equal(engine.search(*query), expected)
+    # the second run answers the terms from the cache
+    hits = engine.hits
+    pandas.testing.assert_frame_equal(engine.search(*query), expected)
+    # short terms and regexes within a price range are scanned, not cached
+    if engine.misses:
+        assert engine.hits > hits
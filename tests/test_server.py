@@ -0,0 +1,48 @@
+from http.server import ThreadingHTTPServer
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+pandas = pytest.importorskip("pandas")
+
+from bazos_search import SearchEngine, TrigramIndex
+from bazos_server import QueryHandler, QueryService
+
+
+@pytest.fixture
+def url():
+    df = pandas.DataFrame(
+        {
+            "title": ["Nové kolo", "Staré kolo"],
+            "price": [1500.0, 800.0],
+            "price_string": ["1 500", "800"],
+            "link": ["https://sp.bazos.cz/inzerat/1/kolo.php", "https://sp.bazos.cz/inzerat/2/kolo.php"],
+            "datetime": pandas.to_datetime(["2022-05-01", "2022-05-02"], utc=True).tz_convert("Europe/Prague"),
+        }
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), QueryHandler)
+    server.service = QueryService({"sp": SearchEngine(df, TrigramIndex.build(df.title))})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def post(url, query):
+    req = urllib.request.Request(url, data=json.dumps(query).encode())
+    with urllib.request.urlopen(req) as response:
+        return json.loads(response.read())
+
+
+def test_search(url):
+    assert post(url + "/search", {"section": "sp", "keywords": [["nové"]]})["count"] == 1
+
+
+def test_invalid_regex_is_a_bad_request(url):
+    with pytest.raises(urllib.error.HTTPError) as e:
+        post(url + "/search", {"section": "sp", "keywords": [["[nové"]]})
+    assert e.value.code == 400
+    e.value.close()